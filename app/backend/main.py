@@ -1,143 +1,245 @@
 # In app/backend/main.py
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
-from fastapi.responses import JSONResponse
-from typing import List
-import shutil
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Depends, Header, BackgroundTasks, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Iterable, List, Optional, Dict, Any, Union
+import asyncio
+import hashlib
 import os
-import PyPDF2
-import uuid
+import zlib
+import orjson
+import aiofiles
+from cachetools import LRUCache
 from contextlib import asynccontextmanager
+from pathlib import Path
 
-# Load environment variables from .env file
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-   
-    pass
-
-from app.utils.gemini_utils import generate_summary 
-
+from app.utils.env_utils import load_env
 
+load_env()
 
+from app.utils.gemini_utils import (
+    generate_summary, generate_challenge_questions, evaluate_user_answer, evaluate_user_answers_batch, embed_text, create_document_cache, usable_context_cache
+)
 from app.utils.graph_utils import ask_anything_graph_app, AskAnythingState
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage 
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk
 from app.utils.mongo_utils import mongo_manager, init_mongodb, cleanup_mongodb
+from app.utils.pdf_utils import DocumentExtractionError, extract_pdf_text, shutdown_pdf_pool, start_pdf_pool
+from app.utils.session_store import session_store, new_chat_history
+from app.utils.semantic_cache import semantic_cache
+from app.utils.retrieval_utils import build_document_index
+from app.utils.logging_utils import get_logger
+
+logger = get_logger("backend")
 
-# Updated document_store
-document_store = {
-    "filename": None,
-    "text": None,
-    "summary": None,
-    "chat_history": [],
-    "session_id": None
-}
 
 UPLOADS_DIR = "uploads"
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB chunks keep read/write syscalls low for large PDFs
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
+# Documents longer than RAG_MIN_DOC_CHARS are indexed at upload; /ask then prompts with the
+# RAG_TOP_K most relevant chunks instead of the whole text.
+RAG_MIN_DOC_CHARS = int(os.getenv("RAG_MIN_DOC_CHARS", "20000"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+
+# Question embeddings started by /prewarm while the user is still typing, keyed by the question
+# text. Values are asyncio tasks so /ask can await one that is still in flight.
+PREWARM_MAX_QUESTIONS = int(os.getenv("PREWARM_MAX_QUESTIONS", "256"))
+_prewarmed_embeddings: LRUCache = LRUCache(maxsize=PREWARM_MAX_QUESTIONS)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    start_pdf_pool()
     await init_mongodb()
     yield
     await cleanup_mongodb()
-
-app = FastAPI(lifespan=lifespan)
-
-async def get_document_text():
-    if document_store["text"] is None:
+    shutdown_pdf_pool()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+async def get_session(x_session_id: Optional[str] = Header(None)) -> Optional[Dict[str, Any]]:
+    # Sessions are created by /upload; clients send the returned id back in the X-Session-ID header.
+    session = session_store.get(x_session_id)
+    if session is None and x_session_id:
+        session = await _restore_session(x_session_id)
+    return session
+
+async def _restore_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Rebuilds a session this process doesn't hold (evicted from the LRU, or uploaded through
+    another worker) from MongoDB. The Gemini context cache and retrieval index are not restored,
+    so /ask falls back to sending the full document.
+    """
+    record = await mongo_manager.get_session_record(session_id)
+    if record is None:
+        return None
+    filename, chat_history = record
+    document = await mongo_manager.get_document(filename, ["summary", "text"])
+    if not document or not document.get("text"):
+        return None
+    # Another request for the same session may have restored it while this one was waiting.
+    session = session_store.get(session_id)
+    if session is not None:
+        return session
+    session = session_store.create(session_id)
+    session["filename"] = filename
+    session["text"] = document["text"]
+    session["doc_hash"] = hashlib.sha256(document["text"].encode("utf-8")).hexdigest()
+    session["summary"] = document.get("summary")
+    session["chat_history"] = new_chat_history(chat_history)
+    logger.info("Restored session %s for %s from MongoDB", session_id, filename)
+    return session
+
+async def get_document_text(session: Optional[Dict[str, Any]] = Depends(get_session)):
+    if session is None or session["text"] is None:
         raise HTTPException(status_code=404, detail="No document uploaded or processed yet.")
-    return document_store["text"]
+    return session["text"]
+
+async def get_chat_history(session: Optional[Dict[str, Any]] = Depends(get_session)) -> Iterable[BaseMessage]:
+    # A bounded deque per session; callers take a list() copy before handing it to the graph.
+    if session is None:
+        return []
+    return session.get("chat_history") or []
+
+def _upload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File is too large. The maximum upload size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+
+async def _read_upload(file: UploadFile) -> bytes:
+    chunks = []
+    total = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise _upload_too_large()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def _gunzip_upload(data: bytes) -> bytes:
+    # Bounded decompression: a small gzip body must not be able to expand past MAX_UPLOAD_BYTES.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        decompressed = decompressor.decompress(data, MAX_UPLOAD_BYTES + 1)
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"Could not decompress the uploaded file: {str(e)}")
+    if len(decompressed) > MAX_UPLOAD_BYTES or decompressor.unconsumed_tail:
+        raise _upload_too_large()
+    if not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Could not decompress the uploaded file: the gzip stream is truncated.")
+    return decompressed
+
+async def _write_upload_to_disk(file_path: str, data: bytes) -> None:
+    try:
+        async with aiofiles.open(file_path, "wb") as buffer:
+            await buffer.write(data)
+    except Exception as e:
+        logger.exception("Error persisting upload to %s: %s", file_path, e)
 
-async def get_chat_history() -> List[BaseMessage]:
-    # Ensures chat_history is always a list, even if somehow becomes None
-    return document_store.get("chat_history", [])
+async def _cache_and_summarize(session: Dict[str, Any], document_text: str) -> str:
+    session["context_cache"] = await create_document_cache(document_text)
+    return await generate_summary(document_text, cached_content=session["context_cache"])
 
-def get_or_create_session_id() -> str:
-    if not document_store.get("session_id"):
-        document_store["session_id"] = str(uuid.uuid4())
-    return document_store["session_id"]
+def _extract_text(data: bytes, extension: str) -> str:
+    """Blocking text extraction; run it via asyncio.to_thread so the event loop stays free."""
+    if extension == "txt":
+        return data.decode("utf-8")
+    return extract_pdf_text(data)
 
 @app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
+async def upload_document(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    content_encoding: Optional[str] = Form(None)
+):
+    # Content-Length covers the whole multipart body (file plus a little framing), so allow some
+    # slack here; the running count in _read_upload enforces the exact limit on the file itself.
+    try:
+        content_length = int(request.headers.get("content-length", 0))
+    except ValueError:
+        content_length = 0
+    if content_length > MAX_UPLOAD_BYTES + 64 * 1024:
+        raise _upload_too_large()
+
     allowed_extensions = {"txt", "pdf"}
-    filename = file.filename
-    extension = filename.split(".")[-1].lower()
+    # Keep only the basename so a crafted filename ("../x.pdf", "a/b.txt") cannot escape UPLOADS_DIR.
+    filename = Path(file.filename or "").name
+    extension = Path(filename).suffix.lower().lstrip(".")
 
-    if extension not in allowed_extensions:
+    if not filename or extension not in allowed_extensions:
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a TXT or PDF file.")
+    if content_encoding not in (None, "", "identity", "gzip"):
+        raise HTTPException(status_code=400, detail=f"Unsupported content encoding '{content_encoding}'. Use gzip or send the file uncompressed.")
 
-    file_path = os.path.join(UPLOADS_DIR, filename)
+    file_path = str(Path(UPLOADS_DIR) / filename)
 
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        extracted_text = ""
-        if extension == "txt":
-            with open(file_path, "r", encoding="utf-8") as f:
-                extracted_text = f.read()
-        elif extension == "pdf":
-            try:
-                with open(file_path, "rb") as f:
-                    reader = PyPDF2.PdfReader(f)
-                    if not reader.pages:
-                        os.remove(file_path)
-                        raise HTTPException(status_code=400, detail="PDF file has no pages or is corrupted.")
-                    for page_num in range(len(reader.pages)):
-                        page = reader.pages[page_num]
-                        extracted_text += page.extract_text() or ""
-            except PyPDF2.errors.PdfReadError as pre:
-                os.remove(file_path)
-                raise HTTPException(status_code=400, detail=f"Error reading PDF (possibly encrypted or corrupted): {str(pre)}")
-            except Exception as e:
-                os.remove(file_path)
-                raise HTTPException(status_code=500, detail=f"Error processing PDF file: {str(e)}")
+        data = await _read_upload(file)
+        # Large files may arrive gzip-compressed by the frontend; the field names the encoding of the file part.
+        if content_encoding == "gzip":
+            data = await asyncio.to_thread(_gunzip_upload, data)
+
+        # Parse straight from memory; the copy on disk is only kept for reference and is
+        # written after the response has been sent.
+        try:
+            extracted_text = await asyncio.to_thread(_extract_text, data, extension)
+        except DocumentExtractionError as dee:
+            raise HTTPException(status_code=dee.status_code, detail=dee.detail)
 
         if not extracted_text.strip():
-            os.remove(file_path)
             raise HTTPException(status_code=400, detail="Could not extract text from the document. The document might be empty or scanned (image-based).")
 
-        document_store["filename"] = filename
-        document_store["text"] = extracted_text
-        document_store["summary"] = None
-        document_store["chat_history"] = []
-        document_store["session_id"] = str(uuid.uuid4())
+        session = session_store.create()
+        session["filename"] = filename
+        session["text"] = extracted_text
+        session["doc_hash"] = hashlib.sha256(extracted_text.encode("utf-8")).hexdigest()
+
+        # The summary only needs the extracted text, so the Gemini calls, the retrieval index
+        # and the MongoDB writes run concurrently; the summary is attached to the stored
+        # document once it is ready. The empty chat history records the session, so another
+        # worker (or this one after eviction) can restore it.
+        summary_result, retrieval_index, _, _ = await asyncio.gather(
+            _cache_and_summarize(session, extracted_text),
+            _build_retrieval_index(extracted_text),
+            mongo_manager.store_document(
+                filename=filename,
+                text=extracted_text,
+                summary=None,
+                file_path=file_path
+            ),
+            mongo_manager.store_chat_history(session["session_id"], filename, []),
+            return_exceptions=True
+        )
+        session["retrieval_index"] = None if isinstance(retrieval_index, BaseException) else retrieval_index
 
         current_summary = None
         summary_error_detail = None
-        try:
-            current_summary = await generate_summary(extracted_text)
-            document_store["summary"] = current_summary
-        except HTTPException as e:
-            print(f"HTTPException generating summary for {filename}: {e.detail}")
-            summary_error_detail = e.detail
-        except Exception as e:
-            print(f"Unexpected error generating summary for {filename}: {str(e)}")
-            summary_error_detail = str(e)
-
-        await mongo_manager.store_document(
-            filename=filename,
-            text=extracted_text,
-            summary=current_summary,
-            file_path=file_path
-        )
+        if isinstance(summary_result, HTTPException):
+            logger.warning("HTTPException generating summary for %s: %s", filename, summary_result.detail)
+            summary_error_detail = summary_result.detail
+        elif isinstance(summary_result, BaseException):
+            logger.error("Unexpected error generating summary for %s: %s", filename, summary_result, exc_info=summary_result)
+            summary_error_detail = str(summary_result)
+        else:
+            current_summary = summary_result
+            session["summary"] = current_summary
+            await mongo_manager.update_document_summary(filename, current_summary)
+
+        background_tasks.add_task(_write_upload_to_disk, file_path, data)
 
         if current_summary:
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "message": "Document uploaded, processed, and summarized successfully.",
-                    "filename": filename,
-                    "summary": current_summary
-                }
-            )
+            return {
+                "message": "Document uploaded, processed, and summarized successfully.",
+                "filename": filename,
+                "session_id": session["session_id"],
+                "summary": current_summary
+            }
         else:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=207,
                 content={
                     "message": "Document uploaded and text extracted, but summary generation failed.",
                     "filename": filename,
+                    "session_id": session["session_id"],
                     "text_extract_status": "Success",
                     "summary_status": "Failed",
                     "summary_error": summary_error_detail or "Unknown error during summary generation."
@@ -146,91 +248,222 @@ async def upload_document(file: UploadFile = File(...)):
     except HTTPException:
         raise
     except Exception as e:
-        if os.path.exists(file_path):
-            os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during upload: {str(e)}")
     finally:
         if file and hasattr(file, 'file') and not file.file.closed:
              file.file.close()
 
 
-@app.post("/ask")
-async def ask_question_endpoint(
-    question: str, 
-    doc_text: str = Depends(get_document_text),
-    current_chat_history: List[BaseMessage] = Depends(get_chat_history)
-):
+async def _persist_chat_history(session: Dict[str, Any], updated_history: List[BaseMessage]) -> None:
+    previous_history = session["chat_history"]
+    session["chat_history"] = new_chat_history(updated_history)
+    if not session.get("filename"):
+        return
+    # A normal turn only appends to the stored history, so only the new messages are sent. After
+    # compaction the history no longer starts with the same messages and is rewritten in full.
+    if len(updated_history) >= len(previous_history) and all(a is b for a, b in zip(previous_history, updated_history)):
+        new_messages = updated_history[len(previous_history):]
+        if new_messages:
+            await mongo_manager.append_chat_messages(session["session_id"], session["filename"], new_messages)
+        return
+    await mongo_manager.store_chat_history(
+        session_id=session["session_id"],
+        document_filename=session["filename"],
+        chat_history=updated_history
+    )
+
+async def _build_retrieval_index(document_text: str):
+    if len(document_text) <= RAG_MIN_DOC_CHARS:
+        return None
+    try:
+        return await build_document_index(document_text)
+    except Exception as e:
+        logger.warning("Could not build retrieval index, /ask will use the full document: %s", e)
+        return None
+
+async def _embed_question(question: str) -> Optional[List[float]]:
+    # The semantic cache is an optimisation; an embedding failure just means a cache miss.
+    try:
+        prewarmed = _prewarmed_embeddings.pop(question.strip(), None)
+        if prewarmed is not None:
+            return await prewarmed
+        return await embed_text(question)
+    except Exception as e:
+        logger.warning("Skipping semantic cache for question, embedding failed: %s", e)
+        return None
+
+class PrewarmRequest(BaseModel):
+    question: str = Field(..., min_length=1)
+
+@app.post("/prewarm", status_code=202)
+async def prewarm_question_endpoint(request_data: PrewarmRequest, doc_text: str = Depends(get_document_text)):
+    # Fire-and-forget: start embedding the question now so a following /ask finds it ready.
+    key = request_data.question.strip()
+    if key and key not in _prewarmed_embeddings:
+        task = asyncio.create_task(embed_text(key))
+        # Retrieve any failure so tasks evicted before /ask awaits them don't log "never retrieved".
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        _prewarmed_embeddings[key] = task
+    return {"status": "accepted"}
+
+ASK_JUSTIFICATION_NOTE = "Justification is part of the conversational answer. Review history for full context."
+
+async def _prepare_ask(question: str, doc_text: str, current_chat_history: Iterable[BaseMessage], session: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Shared front half of /ask and /ask/stream: loads the history, then either answers
+    from the semantic cache ("cached_answer") or returns the graph input ("graph_input_state").
+    """
     if not question or not question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
 
-    session_id = get_or_create_session_id()
+    session_id = session["session_id"]
     
-    if mongo_manager.is_connected and document_store.get("filename"):
-        stored_history = await mongo_manager.get_chat_history(session_id, document_store["filename"])
+    if session.get("filename"):
+        stored_history = await mongo_manager.get_chat_history(session_id, session["filename"])
         if stored_history:
             current_chat_history = stored_history
-            document_store["chat_history"] = stored_history
-
+            session["chat_history"] = new_chat_history(stored_history)
+
+    # Histories longer than the turn window are summarized inside the graph node.
+    current_chat_history = list(current_chat_history)
+
+    # Only first-turn questions go through the semantic cache: follow-ups depend on the
+    # conversation so far and must not be answered from another session's history.
+    is_first_turn = not current_chat_history
+    question_embedding = None
+    if is_first_turn:
+        question_embedding = await _embed_question(question)
+        if question_embedding is not None:
+            cached = await semantic_cache.lookup(session["doc_hash"], question_embedding)
+            if cached is not None:
+                cached_answer = cached[1]
+                await _persist_chat_history(session, [HumanMessage(content=question), AIMessage(content=cached_answer)])
+                return {"cached_answer": cached_answer}
+
+    # A Gemini context cache already holds the whole document, so retrieval is only needed without one.
+    context_cache = usable_context_cache(session.get("context_cache"))
+    document_excerpts = None
+    retrieval_index = session.get("retrieval_index")
+    if context_cache is None and retrieval_index is not None:
+        if question_embedding is None:
+            question_embedding = await _embed_question(question)
+        if question_embedding is not None:
+            document_excerpts = "\n\n[...]\n\n".join(retrieval_index.search(question_embedding, k=RAG_TOP_K))
 
     graph_input_state = AskAnythingState(
         document_text=doc_text,
+        document_excerpts=document_excerpts,
         input_question=question,
         chat_history=current_chat_history, 
-        answer="" 
+        answer="",
+        context_cache_name=context_cache.name if context_cache is not None else None,
+        context_cache_model=context_cache.model if context_cache is not None else None,
     )
+    return {"graph_input_state": graph_input_state, "is_first_turn": is_first_turn, "question_embedding": question_embedding}
 
-    try:
-        final_graph_state = await ask_anything_graph_app.ainvoke(graph_input_state)
-        updated_history = final_graph_state.get("chat_history", [])
-        document_store["chat_history"] = updated_history
-
-        if mongo_manager.is_connected and document_store.get("filename"):
-            await mongo_manager.store_chat_history(
-                session_id=session_id,
-                document_filename=document_store["filename"],
-                chat_history=updated_history
-            )
+async def _finish_ask(question: str, session: Dict[str, Any], prepared: Dict[str, Any], final_graph_state: Dict[str, Any]) -> str:
+    updated_history = final_graph_state.get("chat_history", [])
+    await _persist_chat_history(session, updated_history)
+
+    answer = final_graph_state.get("answer", "No answer generated.")
+    question_embedding = prepared["question_embedding"]
+    if prepared["is_first_turn"] and question_embedding is not None and final_graph_state.get("answer"):
+        await semantic_cache.store(session["doc_hash"], question_embedding, question, answer)
+    return answer
 
+@app.post("/ask")
+async def ask_question_endpoint(
+    question: str, 
+    doc_text: str = Depends(get_document_text),
+    current_chat_history: Iterable[BaseMessage] = Depends(get_chat_history),
+    session: Optional[Dict[str, Any]] = Depends(get_session)
+):
+    prepared = await _prepare_ask(question, doc_text, current_chat_history, session)
+    if "cached_answer" in prepared:
+        return {"answer": prepared["cached_answer"], "justification": ASK_JUSTIFICATION_NOTE}
 
-        return JSONResponse(content={
-            "answer": final_graph_state.get("answer", "No answer generated."),
-            "justification": "Justification is part of the conversational answer. Review history for full context."
-        })
+    try:
+        final_graph_state = await ask_anything_graph_app.ainvoke(prepared["graph_input_state"])
+        answer = await _finish_ask(question, session, prepared, final_graph_state)
+        return {
+            "answer": answer,
+            "justification": ASK_JUSTIFICATION_NOTE
+        }
     except Exception as e:
        
-        print(f"Error during LangGraph invocation in /ask endpoint: {e}")
+        logger.exception("Error during LangGraph invocation in /ask endpoint: %s", e)
        
         raise HTTPException(status_code=500, detail=f"An error occurred while processing your question with the AI graph: {str(e)}")
 
+def _ndjson_line(payload: Dict[str, Any]) -> bytes:
+    return orjson.dumps(payload) + b"\n"
+
+@app.post("/ask/stream")
+async def ask_question_stream_endpoint(
+    question: str, 
+    doc_text: str = Depends(get_document_text),
+    current_chat_history: Iterable[BaseMessage] = Depends(get_chat_history),
+    session: Optional[Dict[str, Any]] = Depends(get_session)
+):
+    """
+    Same as /ask, but streams newline-delimited JSON: {"delta": ...} for each answer token as the
+    model produces it, then one {"done": true, "answer", "justification"} line (or {"error": ...}).
+    """
+    prepared = await _prepare_ask(question, doc_text, current_chat_history, session)
+
+    async def event_stream():
+        if "cached_answer" in prepared:
+            yield _ndjson_line({"delta": prepared["cached_answer"]})
+            yield _ndjson_line({"done": True, "answer": prepared["cached_answer"], "justification": ASK_JUSTIFICATION_NOTE})
+            return
+        try:
+            final_graph_state = None
+            async for mode, chunk in ask_anything_graph_app.astream(prepared["graph_input_state"], stream_mode=["messages", "values"]):
+                if mode == "messages":
+                    message_chunk, metadata = chunk
+                    # "messages" mode also emits the messages the node returns (the new turn, or the
+                    # compacted history); only the model's token chunks are part of the answer.
+                    if not isinstance(message_chunk, AIMessageChunk) or metadata.get("langgraph_node") != "llm_call":
+                        continue
+                    if isinstance(message_chunk.content, str) and message_chunk.content:
+                        yield _ndjson_line({"delta": message_chunk.content})
+                else:
+                    final_graph_state = chunk
+            answer = await _finish_ask(question, session, prepared, final_graph_state or {})
+            yield _ndjson_line({"done": True, "answer": answer, "justification": ASK_JUSTIFICATION_NOTE})
+        except Exception as e:
+            logger.exception("Error during LangGraph streaming in /ask/stream endpoint: %s", e)
+            yield _ndjson_line({"error": f"An error occurred while processing your question with the AI graph: {str(e)}"})
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
 
 @app.get("/summary")
-async def get_summary_endpoint():
+async def get_summary_endpoint(session: Optional[Dict[str, Any]] = Depends(get_session)):
    
-    if document_store["text"] is None:
+    if session is None or session["text"] is None:
          raise HTTPException(status_code=404, detail="No document uploaded yet. Please upload a document first.")
-    if document_store["summary"] is None:
+    if session["summary"] is None:
         raise HTTPException(status_code=404, detail="Summary not available for the current document. It might have failed during generation.")
-    return JSONResponse(content={"summary": document_store["summary"], "filename": document_store["filename"]})
+    return {"summary": session["summary"], "filename": session["filename"]}
 
 
-from pydantic import BaseModel, Field
-from app.utils.gemini_utils import generate_challenge_questions, evaluate_user_answer
-
 @app.post("/challenge")
-async def get_challenge_questions_endpoint(doc_text: str = Depends(get_document_text)):
+async def get_challenge_questions_endpoint(fresh: bool = False, doc_text: str = Depends(get_document_text), session: Optional[Dict[str, Any]] = Depends(get_session)):
+    """Returns challenge questions for the session's document; fresh=true skips the cached question set."""
     try:
         num_questions = 3
-        response_data = await generate_challenge_questions(doc_text, num_questions)
+        response_data = await generate_challenge_questions(doc_text, num_questions, cached_content=session.get("context_cache"), no_cache=fresh)
         if "error" in response_data:
              raise HTTPException(status_code=500, detail=response_data.get("raw_response", response_data["error"]))
         if not response_data.get("questions") or len(response_data.get("questions", [])) != num_questions: # Check length safely
-            print(f"Error: Did not receive the expected number of challenge questions. Response: {response_data}")
+            logger.error("Did not receive the expected number of challenge questions. Response: %s", response_data)
             raise HTTPException(status_code=500, detail=f"Could not generate the required number of challenge questions. Assistant response: {response_data.get('questions', 'No questions found.')}")
-        return JSONResponse(content=response_data)
+        return response_data
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Unexpected error in /challenge endpoint: {e}")
+        logger.exception("Unexpected error in /challenge endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred while generating challenge questions: {str(e)}")
 
 class EvaluationRequest(BaseModel):
@@ -238,43 +471,92 @@ class EvaluationRequest(BaseModel):
     user_answer: str = Field(..., min_length=1)
 
 @app.post("/evaluate")
-async def evaluate_user_answer_endpoint(request_data: EvaluationRequest, doc_text: str = Depends(get_document_text)):
+async def evaluate_user_answer_endpoint(request_data: EvaluationRequest, doc_text: str = Depends(get_document_text), session: Optional[Dict[str, Any]] = Depends(get_session)):
     try:
-        response_data = await evaluate_user_answer(doc_text, request_data.original_question, request_data.user_answer)
+        response_data = await evaluate_user_answer(doc_text, request_data.original_question, request_data.user_answer, cached_content=session.get("context_cache"))
         if "error" in response_data:
              raise HTTPException(status_code=500, detail=response_data.get("raw_response", response_data["error"]))
-        return JSONResponse(content=response_data)
+        return response_data
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Unexpected error in /evaluate endpoint: {e}")
+        logger.exception("Unexpected error in /evaluate endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred while evaluating the answer: {str(e)}")
 
+class EvaluationBatchItem(BaseModel):
+    id: Union[str, int]
+    original_question: str = Field(..., min_length=1)
+    user_answer: str = Field(..., min_length=1)
+
+class EvaluationBatchRequest(BaseModel):
+    items: List[EvaluationBatchItem] = Field(..., min_length=1)
+
+@app.post("/evaluate_batch")
+async def evaluate_user_answers_batch_endpoint(request_data: EvaluationBatchRequest, doc_text: str = Depends(get_document_text), session: Optional[Dict[str, Any]] = Depends(get_session)):
+    # One round trip for the whole challenge set; the evaluations themselves run concurrently.
+    # A failed item is reported in its own result instead of failing the batch.
+    responses = await evaluate_user_answers_batch(
+        doc_text,
+        [(item.original_question, item.user_answer) for item in request_data.items],
+        cached_content=session.get("context_cache"),
+    )
+    results = []
+    for item, response_data in zip(request_data.items, responses):
+        if isinstance(response_data, BaseException):
+            logger.error("Unexpected error in /evaluate_batch for item %s: %s", item.id, response_data, exc_info=response_data)
+            detail = response_data.detail if isinstance(response_data, HTTPException) else str(response_data)
+            response_data = {"error": "EvaluationFailed", "feedback": f"An unexpected error occurred while evaluating the answer: {detail}", "justification": "", "is_correct": False}
+        elif "error" in response_data:
+            response_data = {**response_data, "feedback": response_data.get("raw_response", response_data["error"]), "justification": "", "is_correct": False}
+        results.append({"id": item.id, **response_data})
+    return {"results": results}
+
 @app.get("/health")
-async def health_check():
+async def health_check(session: Optional[Dict[str, Any]] = Depends(get_session)):
     mongo_health = await mongo_manager.health_check()
-    return JSONResponse(content={
+    session_info = None
+    if session is not None:
+        session_info = {
+            "current_document": session.get("filename"),
+            "has_text": session.get("text") is not None,
+            "has_summary": session.get("summary") is not None,
+            "chat_history_length": len(session.get("chat_history") or [])
+        }
+    return {
         "status": "healthy",
-        "document_store": {
-            "current_document": document_store.get("filename"),
-            "has_text": document_store.get("text") is not None,
-            "has_summary": document_store.get("summary") is not None,
-            "chat_history_length": len(document_store.get("chat_history", []))
+        "session_store": {
+            "active_sessions": len(session_store),
+            "session": session_info
         },
         "mongodb": mongo_health
-    })
+    }
 
 @app.get("/")
 async def read_root():
-    return {"message": "Backend is running. Current document: " + str(document_store.get("filename"))}
+    return {"message": f"Backend is running. Active sessions: {len(session_store)}"}
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
    
     HOST = os.getenv("BACKEND_HOST")
     PORT = int(os.getenv("BACKEND_PORT"))
     
-    print(f"Attempting to run backend on {HOST}:{PORT}. Ensure GEMINI_API_KEY is set in your environment.")
+    RELOAD = os.getenv("BACKEND_RELOAD", "0") == "1"
+    WORKERS = int(os.getenv("BACKEND_WORKERS", "1"))
+    # uvloop has no Windows build; "auto" lets uvicorn fall back to asyncio/h11 there.
+    LOOP = os.getenv("BACKEND_LOOP", "auto" if sys.platform == "win32" else "uvloop")
+    HTTP = os.getenv("BACKEND_HTTP", "httptools")
+    
+    logger.info("Attempting to run backend on %s:%s. Ensure GEMINI_API_KEY is set in your environment.", HOST, PORT)
     if not os.getenv("GEMINI_API_KEY"):
-        print("WARNING: GEMINI_API_KEY is not set. Gemini API calls will fail.")
-    uvicorn.run("main:app", host=HOST, port=PORT, reload=True, factory=False, app_dir="app/backend")
+        logger.warning("GEMINI_API_KEY is not set. Gemini API calls will fail.")
+    if RELOAD:
+        uvicorn.run("main:app", host=HOST, port=PORT, reload=True, factory=False, app_dir="app/backend", loop=LOOP, http=HTTP)
+    elif WORKERS > 1:
+        # Sessions and their caches are per process; see the README before running several workers.
+        logger.warning("Starting %s workers: sessions are held per process, so requests for one session should reach the same worker.", WORKERS)
+        # Multiple workers need an import string so each process can load the app itself.
+        uvicorn.run("main:app", host=HOST, port=PORT, workers=WORKERS, app_dir="app/backend", loop=LOOP, http=HTTP)
+    else:
+        uvicorn.run(app, host=HOST, port=PORT, loop=LOOP, http=HTTP)
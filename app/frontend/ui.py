@@ -2,168 +2,483 @@
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import gzip
+import json
+from collections import deque
 import os
+from dataclasses import dataclass, field
+from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+BACKEND_URL = (os.getenv("BACKEND_URL") or "").rstrip("/")
+# Uploads above this size are gzip-compressed before sending, when that actually shrinks them.
+UPLOAD_COMPRESS_MIN_BYTES = 256 * 1024
+_URL_UPLOAD = f"{BACKEND_URL}/upload"
+_URL_ASK_STREAM = f"{BACKEND_URL}/ask/stream"
+_URL_PREWARM = f"{BACKEND_URL}/prewarm"
+_URL_CHALLENGE = f"{BACKEND_URL}/challenge"
+_URL_EVAL = f"{BACKEND_URL}/evaluate"
+_URL_EVAL_BATCH = f"{BACKEND_URL}/evaluate_batch"
+
+
+@st.cache_resource
+def _get_http_session():
+    # Streamlit re-executes this script on every interaction; cache_resource keeps one pooled,
+    # keep-alive session per server process so backend calls skip the TCP/TLS handshake.
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    # urllib3 only retries idempotent methods by default, so POSTs (uploads, questions, evaluations)
+    # are not retried: the backend may already have acted on them.
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # /challenge only generates questions, so it is safe to resend. requests picks the adapter
+    # with the longest matching URL prefix.
+    challenge_adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=10,
+        max_retries=retry.new(allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"})
+    )
+    session.mount(_URL_CHALLENGE, challenge_adapter)
+    return session
 
 
-BACKEND_URL = os.getenv("BACKEND_URL")
+@st.cache_resource
+def _get_job_executor():
+    return ThreadPoolExecutor(max_workers=4)
 
 
-def upload_document_to_backend(uploaded_file_obj):
-    if uploaded_file_obj is not None:
-        files = {'file': (uploaded_file_obj.name, uploaded_file_obj.getvalue(), uploaded_file_obj.type)}
-        try:
-            response = requests.post(f"{BACKEND_URL}/upload", files=files, timeout=300)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.Timeout:
-            st.error(f"Error uploading document: The request timed out. The document might be too large or the backend is taking a while.")
-            return None
-        except requests.exceptions.RequestException as e:
-            st.error(f"Error uploading document: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                try: st.error(f"Backend error details: {e.response.json()}")
-                except ValueError: st.error(f"Backend error details: {e.response.text}")
-            return None
-    return None
+# Long backend calls run as futures on a shared executor so the script thread can keep
+# repainting; the future is parked in session_state under one of these keys until it is done.
+PENDING_JOB_KEYS = ("pending_upload", "pending_ask", "pending_evaluation")
+
+def _start_job(job_key, fn, *args):
+    st.session_state[job_key] = _get_job_executor().submit(fn, *args)
+    # Rerun straight away so this run's widgets pick up the pending state and the poller starts.
+    st.rerun()
+
+def _job_pending(job_key):
+    return st.session_state.get(job_key) is not None
 
-def ask_question_to_backend(question: str):
-    if not question.strip():
-        st.warning("Please enter a question.")
+def _take_finished_job(job_key):
+    """Returns the job's result once it has finished (and forgets the job), otherwise None."""
+    future = st.session_state.get(job_key)
+    if future is None or not future.done():
         return None
+    st.session_state[job_key] = None
+    return future.result()
+
+def _watch_pending_jobs():
+    if any(_job_pending(key) and st.session_state[key].done() for key in PENDING_JOB_KEYS):
+        st.rerun()
+
+
+def _json_body(payload):
+    # (data, headers) for a JSON request body; orjson serializes LLM-sized payloads much faster than stdlib json.
+    if orjson is not None:
+        return orjson.dumps(payload), {"Content-Type": "application/json"}
+    return json.dumps(payload), {"Content-Type": "application/json"}
+
+def _loads(raw):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def _parse_json(response):
+    try:
+        return _loads(response.content)
+    except ValueError as e:
+        # Surface undecodable bodies the same way requests' own .json() does, as a RequestException.
+        raise requests.exceptions.InvalidJSONError(f"Invalid JSON in backend response: {e}", response=response)
+
+
+def _session_headers():
+    # The backend keys document state by the session id it returned from /upload.
+    session_id = st.session_state.get("backend_session_id")
+    return {"X-Session-ID": session_id} if session_id else {}
+
+def _request_error_messages(prefix, e):
+    messages = [f"{prefix}: {e}"]
+    if hasattr(e, 'response') and e.response is not None:
+        try: messages.append(f"Backend error details: {e.response.json()}")
+        except ValueError: messages.append(f"Backend error details: {e.response.text}")
+    return messages
+
+# The backend helpers may run on background threads (see _start_job), so they must not
+# touch st.*; they return (data, error_messages) and the caller renders the errors.
+def _post(url, error_prefix, timeout_message="The request timed out.", **kwargs):
     try:
-        response = requests.post(f"{BACKEND_URL}/ask", params={'question': question}, timeout=120) # Increased timeout for potentially longer LLM chains
+        response = _get_http_session().post(url, **kwargs)
         response.raise_for_status()
-        return response.json()
+        return _parse_json(response), []
     except requests.exceptions.Timeout:
-        st.error(f"Error asking question: The request timed out.")
-        return None
+        return None, [f"{error_prefix}: {timeout_message}"]
     except requests.exceptions.RequestException as e:
-        st.error(f"Error asking question: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            try: st.error(f"Backend error details: {e.response.json()}")
-            except ValueError: st.error(f"Backend error details: {e.response.text}")
-        return None
+        return None, _request_error_messages(error_prefix, e)
 
-def get_challenge_questions_from_backend():
+class _BackendError(Exception):
+    def __init__(self, messages):
+        super().__init__("; ".join(messages))
+        self.messages = messages
 
+def upload_document_to_backend(uploaded_file_obj):
+    if uploaded_file_obj is not None:
+        data = None
+        if uploaded_file_obj.size > UPLOAD_COMPRESS_MIN_BYTES:
+            # Text-heavy files shrink several-fold even at level 1; PDFs with already-compressed
+            # streams often don't, in which case the original is sent as-is.
+            compressed = gzip.compress(uploaded_file_obj.getbuffer(), compresslevel=1)
+            if len(compressed) < 0.9 * uploaded_file_obj.size:
+                files = {'file': (uploaded_file_obj.name, compressed, uploaded_file_obj.type)}
+                data = {'content_encoding': 'gzip'}
+        if data is None:
+            # Hand requests the file object itself rather than a getvalue() copy of its bytes.
+            uploaded_file_obj.seek(0)
+            files = {'file': (uploaded_file_obj.name, uploaded_file_obj, uploaded_file_obj.type)}
+        return _post(
+            _URL_UPLOAD, "Error uploading document",
+            timeout_message="The request timed out. The document might be too large or the backend is taking a while.",
+            files=files, data=data, timeout=(10, 300)
+        )
+    return None, []
+
+def ask_question_to_backend(question: str, headers, progress=None):
+    # Reads /ask/stream's NDJSON as it arrives; the partial answer is published in progress["text"]
+    # so the UI can render it before the full answer is ready.
     try:
-        response = requests.post(f"{BACKEND_URL}/challenge", timeout=120)
-        response.raise_for_status()
-        return response.json()
+        with _get_http_session().post(_URL_ASK_STREAM, params={'question': question}, headers=headers, stream=True, timeout=(10, 120)) as response: # Increased timeout for potentially longer LLM chains
+            response.raise_for_status()
+            partial_answer = ""
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    event = _loads(line)
+                except ValueError as e:
+                    raise requests.exceptions.InvalidJSONError(f"Invalid JSON in backend response: {e}", response=response)
+                if "error" in event:
+                    return None, [f"Error asking question: {event['error']}"]
+                if event.get("done"):
+                    return {"answer": event.get("answer", partial_answer), "justification": event.get("justification", "")}, []
+                partial_answer += event.get("delta", "")
+                if progress is not None:
+                    progress["text"] = partial_answer
+            return None, ["Error asking question: The answer stream ended before the answer was complete."]
     except requests.exceptions.Timeout:
-        st.error(f"Error getting challenge questions: The request timed out.")
-        return None
+        return None, ["Error asking question: The request timed out."]
     except requests.exceptions.RequestException as e:
-        st.error(f"Error getting challenge questions: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            try: st.error(f"Backend error details: {e.response.json()}")
-            except ValueError: st.error(f"Backend error details: {e.response.text}")
+        return None, _request_error_messages("Error asking question", e)
+
+def _start_ask_job(question: str):
+    # The worker thread only writes into this plain dict; the fragment below reads it.
+    st.session_state.ask_progress = {}
+    _start_job("pending_ask", _ask_job, question, _session_headers(), st.session_state.ask_progress)
+
+def _prewarm_question():
+    # on_change callback for the question box: lets the backend start embedding the question
+    # before Get Answer is clicked. Best effort only, and never allowed to hold up the UI.
+    question = st.session_state.get("ask_question_field", "").strip()
+    if len(question) <= 8 or not st.session_state.get("backend_session_id"):
+        return
+    body, json_headers = _json_body({"question": question})
+    try:
+        _get_http_session().post(_URL_PREWARM, data=body, headers={**_session_headers(), **json_headers}, timeout=1)
+    except requests.exceptions.RequestException:
+        pass
+
+def _repeated_question_entry(question: str):
+    """The latest Q&A entry if it answered exactly this question, otherwise None."""
+    history = st.session_state.ask_history
+    if history and history[0]["question"].strip() == question.strip():
+        return history[0]
+    return None
+
+def _ask_job(question: str, headers, progress):
+    # Keeps the question alongside the response so the history entry is built from what was asked.
+    return (question, *ask_question_to_backend(question, headers, progress))
+
+def _show_streaming_answer():
+    """Repaints the partial answer of the pending ask job; reruns the app once the job is done."""
+    if st.session_state.pending_ask is None or st.session_state.pending_ask.done():
+        st.rerun()
+    partial_answer = st.session_state.ask_progress.get("text")
+    if partial_answer:
+        st.info(partial_answer)
+    else:
+        st.info("Consulting the document (with memory)...")
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_challenge_questions(session_id, doc_name, generation, _fresh=False):
+    # Keyed by the backend session (one per upload) rather than the file name alone, so two users
+    # with same-named documents never share questions. Failures raise and are therefore not cached.
+    # _fresh is left out of the key; it asks the backend to bypass its own question cache too.
+    headers = {"X-Session-ID": session_id} if session_id else {}
+    params = {"fresh": "true"} if _fresh else None
+    data, errors = _post(_URL_CHALLENGE, "Error getting challenge questions", headers=headers, params=params, timeout=120)
+    if errors:
+        raise _BackendError(errors)
+    return data
+
+def get_challenge_questions_from_backend(force_refresh: bool = False):
+    if force_refresh:
+        st.session_state.challenge_generation = st.session_state.get("challenge_generation", 0) + 1
+    try:
+        return _cached_challenge_questions(
+            st.session_state.get("backend_session_id"),
+            st.session_state.get("processed_doc_name") or "none",
+            st.session_state.get("challenge_generation", 0),
+            _fresh=force_refresh
+        )
+    except _BackendError as e:
+        for message in e.messages: st.error(message)
         return None
 
 
-def evaluate_answers_at_backend(original_question: str, user_answer: str):
+def evaluate_answers_at_backend(original_question: str, user_answer: str, headers=None):
+    # headers can be passed in explicitly so this is safe to call from worker threads,
+    # which have no access to st.session_state.
 
     if not user_answer.strip():
         return {"feedback": "Please provide an answer.", "justification": "", "is_correct": False, "error": "Empty answer"}
     payload = {"original_question": original_question, "user_answer": user_answer}
-    try:
-        response = requests.post(f"{BACKEND_URL}/evaluate", json=payload, timeout=120)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.Timeout:
-        return {"error": "Timeout", "feedback": "Evaluation request timed out.", "justification": "", "is_correct": False}
-    except requests.exceptions.RequestException as e:
-        error_detail = f"Error evaluating answer: {e}"
-        if hasattr(e, 'response') and e.response is not None:
-            try: error_detail += f" Backend: {e.response.json()}"
-            except ValueError: error_detail += f" Backend: {e.response.text}"
-        return {"error": "RequestException", "feedback": error_detail, "justification": "", "is_correct": False}
+    body, json_headers = _json_body(payload)
+    request_headers = {**(headers if headers is not None else _session_headers()), **json_headers}
+    data, errors = _post(_URL_EVAL, "Error evaluating answer", timeout_message="Evaluation request timed out.", data=body, headers=request_headers, timeout=120)
+    if errors:
+        return {"error": "RequestException", "feedback": " ".join(errors), "justification": "", "is_correct": False}
+    return data
+
+def evaluate_answers_batch_at_backend(pairs, headers):
+    """Evaluates all challenge answers in one request. pairs: [{"id", "original_question", "user_answer"}]; returns {id: result}."""
+    body, json_headers = _json_body({"items": pairs})
+    data, errors = _post(_URL_EVAL_BATCH, "Error evaluating answers", timeout_message="Evaluation request timed out.", data=body, headers={**headers, **json_headers}, timeout=180)
+    if errors:
+        error_result = {"error": "RequestException", "feedback": " ".join(errors), "justification": "", "is_correct": False}
+        return {pair["id"]: error_result for pair in pairs}
+    return {result["id"]: result for result in data.get("results", [])}
+
+
+def _evaluation_job(pairs, headers):
+    return pairs, evaluate_answers_batch_at_backend(pairs, headers)
+
+
+@dataclass
+class _SessionDefaults:
+    """Per-document session state and its initial values; every instance gets fresh containers."""
+    # No slots=True: that needs Python 3.10 and the app still supports 3.9.
+    document_uploaded: bool = False
+    document_filename: Optional[str] = None
+    document_summary: Optional[str] = None
+    error_message: Optional[str] = None
+    ask_question_input: str = ""
+    ask_results: Optional[dict] = None
+    challenge_questions: Optional[tuple] = None
+    user_challenge_answers: dict = field(default_factory=dict)
+    challenge_evaluation_results: dict = field(default_factory=dict)
+    processed_doc_name: Optional[str] = None
+    ask_history: deque = field(default_factory=lambda: deque(maxlen=5))
+    backend_session_id: Optional[str] = None
+    ask_results_repeated: bool = False
+    pending_upload: Optional[Future] = None
+    pending_ask: Optional[Future] = None
+    ask_progress: dict = field(default_factory=dict)
+    pending_evaluation: Optional[Future] = None
+
+def _fresh_session_defaults():
+    return vars(_SessionDefaults())
 
 
 def reset_session():
-
-    keys_to_reset = [
-        'document_uploaded', 'document_filename', 'document_summary',
-        'error_message', 'ask_question_input', 'ask_results',
-        'challenge_questions', 'user_challenge_answers',
-        'challenge_evaluation_results', 'processed_doc_name', 'ask_history'
-    ]
-    default_values = {
-        'document_uploaded': False, 'document_filename': None, 'document_summary': None,
-        'error_message': None, 'ask_question_input': "", 'ask_results': None,
-        'challenge_questions': None, 'user_challenge_answers': {},
-        'challenge_evaluation_results': {}, 'processed_doc_name': None,
-        'ask_history': []
-    }
-    for key in keys_to_reset:
-        st.session_state[key] = default_values.get(key, None)
-        if key == 'user_challenge_answers': st.session_state[key] = {}
-        if key == 'challenge_evaluation_results': st.session_state[key] = {}
-        if key == 'ask_history': st.session_state[key] = []
-    if 'file_uploader_key' not in st.session_state:
-        st.session_state.file_uploader_key = 0
-    st.session_state.file_uploader_key += 1
+    st.session_state.update(_fresh_session_defaults())
+    # A new uploader key is what actually clears the selected file: deleting the widget's key from
+    # session_state only drops the server-side value and the browser keeps showing the old file.
+    st.session_state.file_uploader_key = st.session_state.get("file_uploader_key", 0) + 1
 
 
 st.set_page_config(page_title="DocuMind AI", layout="wide", initial_sidebar_state="expanded")
 st.title("🧠 DocuMind AI: Intelligent Document Assistant")
 st.markdown("_Upload a PDF or TXT document to unlock its secrets! This assistant uses AI to help you understand and engage with your documents._")
 
-default_session_keys = {
-    'document_uploaded': False, 'document_filename': None, 'document_summary': None,
-    'error_message': None, 'ask_question_input': "", 'ask_results': None,
-    'challenge_questions': None, 'user_challenge_answers': {},
-    'challenge_evaluation_results': {}, 'processed_doc_name': None,
-    'ask_history': [], 'file_uploader_key': 0
-}
-for key, default_value in default_session_keys.items():
-    if key not in st.session_state:
-        st.session_state[key] = default_value
+if not BACKEND_URL:
+    st.error("BACKEND_URL is not set. Point it at the FastAPI backend (e.g. http://localhost:8000) and restart the app.")
+    st.stop()
 
+for key, default_value in _fresh_session_defaults().items():
+    st.session_state.setdefault(key, default_value)
+st.session_state.setdefault("file_uploader_key", 0)
 
-with st.sidebar:
+# While a backend call is in flight, a small fragment polls it and triggers a full rerun once it finishes.
+if any(_job_pending(key) for key in PENDING_JOB_KEYS):
+    st.fragment(_watch_pending_jobs, run_every=0.5)()
 
-    st.header("📄 Document Operations")
-    st.caption("Upload your document here and manage your session. The AI's responses are based solely on the content of the uploaded document.")
+
+# Widget-heavy panels run as fragments: typing an answer, picking a file or editing the
+# question only reruns that panel instead of the whole script. Anything that changes state
+# shown elsewhere (starting a job, reusing an answer) triggers a full st.rerun().
+def _document_upload_panel():
     uploaded_file = st.file_uploader(
         "Choose a PDF or TXT file",
         type=["pdf", "txt"],
         key=f"file_uploader_{st.session_state.file_uploader_key}",
         help="Supports PDF (text-based) and plain TXT files. Scanned image-based PDFs may not work well."
     )
-    if st.button("Process Document", key="process_doc_btn", disabled=uploaded_file is None, use_container_width=True, help="Click to upload, extract text, and generate an initial summary."):
+    if st.button("Process Document", key="process_doc_btn", disabled=uploaded_file is None or _job_pending("pending_upload"), use_container_width=True, help="Click to upload, extract text, and generate an initial summary."):
         if uploaded_file is not None:
-            with st.spinner("🔬 Analyzing document & crafting summary..."):
-                reset_session()
-                st.session_state.document_filename = uploaded_file.name
-                upload_response = upload_document_to_backend(uploaded_file)
-                if upload_response: 
-                    st.session_state.document_filename = upload_response.get("filename", uploaded_file.name)
-                    st.session_state.processed_doc_name = st.session_state.document_filename
-                    st.session_state.document_uploaded = True
-                    if upload_response.get("summary"):
-                        st.session_state.document_summary = upload_response["summary"]
-                        st.success(f"Doc '{st.session_state.document_filename}' processed!")
-                    elif upload_response.get("message") and "summary generation failed" in upload_response.get("message","").lower():
-                        st.session_state.document_summary = "Summary generation failed."
-                        st.warning(f"Doc processed, summary failed.")
-                        st.session_state.error_message = upload_response.get("summary_error", "Unknown summary error.")
-                    else:
-                        st.session_state.document_summary = "Summary not available."
-                        st.info(f"Doc processed. Summary status unknown.")
-                else: 
-                    st.session_state.error_message = "Failed to upload/process document. Backend call failed or timed out." 
-                    st.error("Document processing failed.")
-                    st.session_state.document_filename = None
-                    st.session_state.processed_doc_name = None
+            reset_session()
+            st.session_state.document_filename = uploaded_file.name
+            _start_job("pending_upload", upload_document_to_backend, uploaded_file)
         else:
             st.warning("Please upload a file first.") 
 
+
+def _ask_input_panel():
+    st.markdown("#### Pose Your Questions")
+    st.caption("Get answers to your questions directly from the document's content. The AI now remembers the conversation context!") 
+
+    col1_ask, col2_ask = st.columns([3,1])
+    with col1_ask:
+        question_input = st.text_input(
+            "Your question:",
+            key="ask_question_field",
+            on_change=_prewarm_question,
+            placeholder="e.g., What were the main findings? Then ask: Why were they significant?", 
+            label_visibility="collapsed",
+            help="Type a clear and specific question. You can ask follow-up questions!" 
+        )
+    with col2_ask:
+        if st.button("💬 Get Answer", key="ask_submit", use_container_width=True, disabled=_job_pending("pending_ask")):
+            if question_input.strip():
+                last_entry = _repeated_question_entry(question_input)
+                if last_entry is not None:
+                    # Re-asking the question that was just answered: show that answer rather than
+                    # paying for another /ask round trip (and a duplicate turn in the backend history).
+                    st.session_state.ask_results = {"answer": last_entry["answer"], "justification": last_entry["justification"]}
+                    st.session_state.ask_results_repeated = True
+                    st.rerun()
+                else:
+                    st.session_state.ask_results = None
+                    _start_ask_job(question_input)
+            else:
+                st.warning("Please enter a question.")
+        if st.session_state.get("ask_results_repeated") and not _job_pending("pending_ask"):
+            if st.button("🔁 Ask again", key="ask_regenerate", use_container_width=True, help="Send the same question to the assistant again instead of reusing the last answer."):
+                st.session_state.ask_results_repeated = False
+                st.session_state.ask_results = None
+                _start_ask_job(question_input)
+
+
+def _challenge_tab():
+    st.markdown("#### Test Your Comprehension")
+    st.caption("The AI will generate questions based on the document. Answer them to test your understanding. Evaluations are also AI-generated and based on the document content.")
+    force_new_challenge = st.checkbox("Force fresh questions", key="force_new_challenge", help="Skip the cached question set for this document and ask the AI again.")
+    if st.button("✨ Generate New Challenge Questions", key="generate_challenge_q", use_container_width=True, help="Generates 3 new questions from the document content."):
+        with st.spinner("Crafting challenge questions..."):
+            st.session_state.challenge_questions = None; st.session_state.user_challenge_answers = {}; st.session_state.challenge_evaluation_results = {}; st.session_state.pending_evaluation = None
+            challenge_response = get_challenge_questions_from_backend(force_refresh=force_new_challenge)
+            if challenge_response and "questions" in challenge_response and challenge_response["questions"]:
+                # Normalised once into (id, text) pairs so reruns just unpack them.
+                processed_questions = []
+                for i_cq, q_data in enumerate(challenge_response["questions"]):
+                    q_id = q_data.get("id", f"q_{i_cq}")
+                    if not isinstance(q_id, (str, int)): q_id = f"q_{i_cq}"
+                    processed_questions.append((str(q_id), str(q_data.get("text", "Question text missing."))))
+                st.session_state.challenge_questions = tuple(processed_questions)
+            elif challenge_response and "error" in challenge_response: st.error(f"Could not generate challenge questions: {challenge_response.get('raw_response', challenge_response['error'])}")
+            else: st.error("Failed to generate challenge questions or no questions returned.")
+    if st.session_state.challenge_questions:
+        # Fold a finished evaluation job into the results before the questions are rendered.
+        evaluation_job = _take_finished_job("pending_evaluation")
+        if evaluation_job is not None:
+            eval_pairs, batch_results = evaluation_job
+            for pair in eval_pairs:
+                eval_response = batch_results.get(pair["id"])
+                st.session_state.challenge_evaluation_results[pair["id"]] = eval_response or {"feedback": "Failed to get evaluation.", "justification": "", "is_correct": False, "error": "NoResult"}
+            if all(res.get("error") is None for res in st.session_state.challenge_evaluation_results.values()): st.success("All answers evaluated!")
+            else: st.warning("Some answers could not be evaluated or an error occurred.")
+        st.markdown("---"); all_answers_provided_challenge = True
+        for i_cq_disp, (q_id, q_text) in enumerate(st.session_state.challenge_questions):
+            st.markdown(f"##### Question {i_cq_disp + 1}:\n\n{q_text}")
+            answer = st.text_area(
+                f"Your answer for Question {i_cq_disp + 1}:",
+                value=st.session_state.user_challenge_answers.get(q_id, ""),
+                key=f"challenge_ans_{q_id}", height=100, label_visibility="collapsed",
+                help=f"Type your answer for question {i_cq_disp+1} here. The evaluation will check against the document's content."
+            )
+            st.session_state.user_challenge_answers[q_id] = answer
+            if not answer.strip(): all_answers_provided_challenge = False
+            if q_id in st.session_state.challenge_evaluation_results:
+                with st.expander(f"Show Evaluation for Question {i_cq_disp+1}", expanded=False):
+                    eval_res = st.session_state.challenge_evaluation_results[q_id]
+                    if eval_res.get("is_correct"): st.success(f"✔️ Correct! {eval_res.get('feedback', '')}")
+                    else: st.error(f"❌ Incorrect. {eval_res.get('feedback', '')}")
+                    st.caption(f"Justification: {eval_res.get('justification', 'N/A')}")
+                    if "error" in eval_res and eval_res["error"] not in ["Empty answer", None]: st.warning(f"Evaluation note: {eval_res.get('feedback')}")
+        st.markdown("---")
+        if st.button("Submit All Answers for Evaluation", key="submit_challenge_eval", use_container_width=True, disabled=not all_answers_provided_challenge or _job_pending("pending_evaluation"), help="All questions must be answered to enable submission."):
+            if not all_answers_provided_challenge: st.warning("Please provide an answer for all questions before submitting.")
+            else:
+                st.session_state.challenge_evaluation_results = {}
+                eval_pairs = []
+                for q_id_eval, original_q_text_eval in st.session_state.challenge_questions:
+                    user_ans_eval = st.session_state.user_challenge_answers.get(q_id_eval, "")
+                    if not user_ans_eval.strip():
+                        st.session_state.challenge_evaluation_results[q_id_eval] = {"feedback": "No answer provided.", "justification": "", "is_correct": False, "error": "Empty answer"}
+                        continue
+                    eval_pairs.append({"id": q_id_eval, "original_question": original_q_text_eval, "user_answer": user_ans_eval})
+                # One /evaluate_batch round trip, run in the background; the backend evaluates the answers concurrently.
+                if eval_pairs:
+                    _start_job("pending_evaluation", _evaluation_job, eval_pairs, _session_headers())
+        if _job_pending("pending_evaluation"):
+            st.info("🧑‍🏫 Evaluating your answers...")
+        elif not all_answers_provided_challenge and st.session_state.challenge_questions :
+             st.caption("*(The 'Submit All Answers' button will be enabled once all questions are answered.)*")
+
+
+with st.sidebar:
+
+    st.header("📄 Document Operations")
+    st.caption("Upload your document here and manage your session. The AI's responses are based solely on the content of the uploaded document.")
+    st.fragment(_document_upload_panel)()
+
+    if _job_pending("pending_upload"):
+        upload_job = _take_finished_job("pending_upload")
+        if upload_job is None:
+            st.info("🔬 Analyzing document & crafting summary...")
+        else:
+            upload_response, upload_errors = upload_job
+            for upload_error in upload_errors: st.error(upload_error)
+            if upload_response: 
+                st.session_state.document_filename = upload_response.get("filename", st.session_state.document_filename)
+                st.session_state.processed_doc_name = st.session_state.document_filename
+                st.session_state.backend_session_id = upload_response.get("session_id")
+                st.session_state.document_uploaded = True
+                if upload_response.get("summary"):
+                    st.session_state.document_summary = upload_response["summary"]
+                    st.success(f"Doc '{st.session_state.document_filename}' processed!")
+                elif upload_response.get("message") and "summary generation failed" in upload_response.get("message","").lower():
+                    st.session_state.document_summary = "Summary generation failed."
+                    st.warning(f"Doc processed, summary failed.")
+                    st.session_state.error_message = upload_response.get("summary_error", "Unknown summary error.")
+                else:
+                    st.session_state.document_summary = "Summary not available."
+                    st.info(f"Doc processed. Summary status unknown.")
+            else: 
+                st.session_state.error_message = "Failed to upload/process document. Backend call failed or timed out." 
+                st.error("Document processing failed.")
+                st.session_state.document_filename = None
+                st.session_state.processed_doc_name = None
+
     st.markdown("---")
     if st.button("🔄 Reset Session & Clear Document", key="reset_session_btn", use_container_width=True, help="Clears the current document, all interactions, and resets the interface."):
         reset_session()
         st.success("Session has been reset.")
-        st.experimental_rerun()
+        st.rerun()
     st.markdown("---")
     with st.expander("💡 Tips for Best Results", expanded=False):
         st.markdown("- Use clear, text-based documents.\n- Ask specific questions for 'Ask Anything'.\n- The AI only knows what's in the document.\n- Ensure PDFs are text-based, not scans.")
@@ -189,38 +504,26 @@ if st.session_state.document_uploaded and st.session_state.document_filename:
     tab1, tab2 = st.tabs(["❓ **Ask Anything**", "🧠 **Challenge Me**"])
 
     with tab1:
-        st.markdown("#### Pose Your Questions")
-        st.caption("Get answers to your questions directly from the document's content. The AI now remembers the conversation context!") 
-
-        col1_ask, col2_ask = st.columns([3,1])
-        with col1_ask:
-            question_input = st.text_input(
-                "Your question:",
-                key="ask_question_field",
-                placeholder="e.g., What were the main findings? Then ask: Why were they significant?", 
-                label_visibility="collapsed",
-                help="Type a clear and specific question. You can ask follow-up questions!" 
-            )
-        with col2_ask:
-            if st.button("💬 Get Answer", key="ask_submit", use_container_width=True):
-                if question_input:
-                    with st.spinner("Consulting the document (with memory)..."): 
-                        st.session_state.ask_results = None
-                        ask_response = ask_question_to_backend(question_input)
-                        if ask_response:
-                            st.session_state.ask_results = ask_response
-                            history_entry = {
-                                "question": question_input,
-                                "answer": ask_response.get("answer", "N/A"),
-                                "justification": ask_response.get("justification", "") 
-                            }
-                            st.session_state.ask_history.insert(0, history_entry)
-                            if len(st.session_state.ask_history) > 5:
-                                st.session_state.ask_history.pop()
-                        else:
-                            st.session_state.ask_results = {"answer": "Failed to get an answer.", "justification": ""}
+        st.fragment(_ask_input_panel)()
+
+        if _job_pending("pending_ask"):
+            ask_job = _take_finished_job("pending_ask")
+            if ask_job is None:
+                st.fragment(_show_streaming_answer, run_every=0.3)()
+            else:
+                asked_question, ask_response, ask_errors = ask_job
+                for ask_error in ask_errors: st.error(ask_error)
+                st.session_state.ask_results_repeated = False
+                if ask_response:
+                    st.session_state.ask_results = ask_response
+                    history_entry = {
+                        "question": asked_question,
+                        "answer": ask_response.get("answer", "N/A"),
+                        "justification": ask_response.get("justification", "") 
+                    }
+                    st.session_state.ask_history.appendleft(history_entry)
                 else:
-                    st.warning("Please enter a question.")
+                    st.session_state.ask_results = {"answer": "Failed to get an answer.", "justification": ""}
 
         if st.session_state.ask_results:
             with st.expander("💡 Assistant's Response", expanded=True):
@@ -253,66 +556,7 @@ if st.session_state.document_uploaded and st.session_state.document_filename:
                     if i < len(st.session_state.ask_history) - 1:
                         st.markdown("---")
 
-    with tab2: 
-        
-        st.markdown("#### Test Your Comprehension")
-        st.caption("The AI will generate questions based on the document. Answer them to test your understanding. Evaluations are also AI-generated and based on the document content.")
-        if st.button("✨ Generate New Challenge Questions", key="generate_challenge_q", use_container_width=True, help="Generates 3 new questions from the document content."):
-            with st.spinner("Crafting challenge questions..."):
-                st.session_state.challenge_questions = None; st.session_state.user_challenge_answers = {}; st.session_state.challenge_evaluation_results = {}
-                challenge_response = get_challenge_questions_from_backend()
-                if challenge_response and "questions" in challenge_response and challenge_response["questions"]:
-                    processed_questions = []
-                    for i_cq, q_data in enumerate(challenge_response["questions"]):
-                        q_id = q_data.get("id", f"q_{i_cq}")
-                        if not isinstance(q_id, (str, int)): q_id = f"q_{i_cq}"
-                        processed_questions.append({"id": q_id, "text": q_data.get("text", "Question text missing.")})
-                    st.session_state.challenge_questions = processed_questions
-                elif challenge_response and "error" in challenge_response: st.error(f"Could not generate challenge questions: {challenge_response.get('raw_response', challenge_response['error'])}")
-                else: st.error("Failed to generate challenge questions or no questions returned.")
-        if st.session_state.challenge_questions:
-            st.markdown("---"); all_answers_provided_challenge = True
-            for i_cq_disp, q_data in enumerate(st.session_state.challenge_questions):
-                q_id = q_data["id"]; q_text = q_data["text"]
-                st.markdown(f"##### Question {i_cq_disp + 1}:"); st.markdown(q_text)
-                answer = st.text_area(
-                    f"Your answer for Question {i_cq_disp + 1}:",
-                    value=st.session_state.user_challenge_answers.get(q_id, ""),
-                    key=f"challenge_ans_{q_id}", height=100, label_visibility="collapsed",
-                    help=f"Type your answer for question {i_cq_disp+1} here. The evaluation will check against the document's content."
-                )
-                st.session_state.user_challenge_answers[q_id] = answer
-                if not answer.strip(): all_answers_provided_challenge = False
-                if q_id in st.session_state.challenge_evaluation_results:
-                    with st.expander(f"Show Evaluation for Question {i_cq_disp+1}", expanded=False):
-                        eval_res = st.session_state.challenge_evaluation_results[q_id]
-                        if eval_res.get("is_correct"): st.success(f"✔️ Correct! {eval_res.get('feedback', '')}")
-                        else: st.error(f"❌ Incorrect. {eval_res.get('feedback', '')}")
-                        st.caption(f"Justification: {eval_res.get('justification', 'N/A')}")
-                        if "error" in eval_res and eval_res["error"] not in ["Empty answer", None]: st.warning(f"Evaluation note: {eval_res.get('feedback')}")
-                st.markdown("---")
-            if st.button("Submit All Answers for Evaluation", key="submit_challenge_eval", use_container_width=True, disabled=not all_answers_provided_challenge, help="All questions must be answered to enable submission."):
-                if not all_answers_provided_challenge: st.warning("Please provide an answer for all questions before submitting.")
-                else:
-                    with st.spinner("🧑‍🏫 Evaluating your answers..."):
-                        st.session_state.challenge_evaluation_results = {}
-                        success_all_evals = True
-                        for q_data_eval in st.session_state.challenge_questions:
-                            q_id_eval = q_data_eval["id"]; original_q_text_eval = q_data_eval["text"]
-                            user_ans_eval = st.session_state.user_challenge_answers.get(q_id_eval, "")
-                            if not user_ans_eval.strip():
-                                st.session_state.challenge_evaluation_results[q_id_eval] = {"feedback": "No answer provided.", "justification": "", "is_correct": False}
-                                success_all_evals = False; continue
-                            eval_response = evaluate_answers_at_backend(original_q_text_eval, user_ans_eval)
-                            if eval_response:
-                                st.session_state.challenge_evaluation_results[q_id_eval] = eval_response
-                                if "error" in eval_response and eval_response["error"] is not None : success_all_evals = False
-                            else:
-                                st.session_state.challenge_evaluation_results[q_id_eval] = {"feedback": "Failed to get evaluation.", "justification": "", "is_correct": False}
-                                success_all_evals = False
-                        if success_all_evals: st.success("All answers evaluated!")
-                        else: st.warning("Some answers could not be evaluated or an error occurred.")
-            elif not all_answers_provided_challenge and st.session_state.challenge_questions :
-                 st.caption("*(The 'Submit All Answers' button will be enabled once all questions are answered.)*")
+    with tab2:
+        st.fragment(_challenge_tab)()
 else:
     st.info("👋 Welcome! Please upload and process a document to begin. Check the sidebar for tips on getting the best results.")
@@ -0,0 +1,14 @@
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def load_env() -> None:
+    """
+    Loads the project's .env file into os.environ, once per process. Every module that reads its
+    config from the environment calls this first; only the first call touches the filesystem.
+    """
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
@@ -1,62 +1,332 @@
 import os
-import google.generativeai as genai
-from google.generativeai.types import GenerateContentResponse
+import asyncio
+import datetime
+import functools
+from types import MappingProxyType
+from typing import List, Optional, Sequence, Tuple, Union
+from google import genai
+from google.genai import types
 from fastapi import HTTPException 
-import json 
-from dotenv import load_dotenv
 
-load_dotenv()
+try:
+    import orjson
+except ImportError:  # same loads/JSONDecodeError surface
+    import json as orjson
 
-# Configure the Gemini API key
 try:
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    genai.configure(api_key=GEMINI_API_KEY)
-except KeyError:
-    print("Error: GEMINI_API_KEY environment variable not set.")
-    GEMINI_API_KEY = None
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
-MODEL_NAME = os.getenv("GEMINI_MODEL_NAME")
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import json5  # lenient fallback for almost-JSON model output
+except ImportError:
+    json5 = None
+from app.utils.llm_cache import llm_cache, make_cache_key
+from app.utils.env_utils import load_env
+from app.utils.logging_utils import get_logger
+
+logger = get_logger("gemini")
 
-def get_gemini_model():
-    """Initializes and returns the Gemini model instance."""
+load_env()
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+if not GEMINI_API_KEY:
+    logger.error("GEMINI_API_KEY environment variable not set.")
+
+MODEL_NAME = os.getenv("GEMINI_MODEL_NAME")
+EMBEDDING_MODEL_NAME = os.getenv("GEMINI_EMBEDDING_MODEL_NAME", "models/text-embedding-004")
+
+CONTEXT_CACHE_TTL_MINUTES = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_MINUTES", "60"))
+# Gemini rejects cached contents below a model-specific token minimum, so short documents stay inline.
+CONTEXT_CACHE_MIN_CHARS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_CHARS", "16000"))
+CACHED_DOCUMENT_PLACEHOLDER = "(The full document is provided in the cached context.)"
+
+# Prompt budgets for the document text, in tokens.
+SUMMARY_MAX_DOC_TOKENS = int(os.getenv("GEMINI_SUMMARY_MAX_DOC_TOKENS", "5000"))
+CHALLENGE_MAX_DOC_TOKENS = int(os.getenv("GEMINI_CHALLENGE_MAX_DOC_TOKENS", "12500"))
+EVAL_MAX_DOC_TOKENS = int(os.getenv("GEMINI_EVAL_MAX_DOC_TOKENS", "12500"))
+# Used to size budgets when tiktoken is not installed, and to bound how much text is tokenized.
+APPROX_CHARS_PER_TOKEN = 4
+MAX_CHARS_PER_TOKEN = 10
+
+@functools.lru_cache(maxsize=1)
+def _get_token_encoding():
+    # cl100k_base is not Gemini's tokenizer, but tracks its token counts far better than character counts.
+    # Loaded lazily: the first call may need to download the encoding file.
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("tiktoken encoding unavailable, estimating tokens from length: %s", e)
+        return None
+
+def truncate_to_tokens(text: str, max_tokens: int, purpose: str) -> str:
+    """Returns text cut to at most max_tokens tokens (estimated from length without tiktoken)."""
+    if len(text) <= max_tokens:  # every token covers at least one character
+        return text
+    token_encoding = _get_token_encoding()
+    if token_encoding is None:
+        max_chars = max_tokens * APPROX_CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        truncated = text[:max_chars]
+    else:
+        # Tokenizing a bounded prefix is enough to find the cut and keeps huge documents cheap.
+        token_ids = token_encoding.encode(text[:max_tokens * MAX_CHARS_PER_TOKEN], disallowed_special=())
+        if len(token_ids) <= max_tokens and len(text) <= max_tokens * MAX_CHARS_PER_TOKEN:
+            return text
+        truncated = token_encoding.decode(token_ids[:max_tokens])
+    logger.info("Document text truncated for %s from %s to %s characters (%s tokens).", purpose, len(text), len(truncated), max_tokens)
+    return truncated
+
+# Every call uses one of these two configs. They are shared by concurrent requests, so they are
+# read-only mappings: an accidental mutation raises instead of leaking into other requests.
+_TEXT_GENERATION_CONFIG = MappingProxyType({"temperature": 0.7})
+_JSON_GENERATION_CONFIG = MappingProxyType({"temperature": 0.7, "response_mime_type": "application/json"})
+
+@functools.lru_cache(maxsize=1)
+def get_gemini_client() -> genai.Client:
+    """Returns the shared Gemini client; don't construct clients per request."""
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY is not configured. Cannot initialize model.")
-    return genai.GenerativeModel(MODEL_NAME)
-
-async def generate_text_from_gemini(prompt: str, is_json_response: bool = False) -> str:
+    return genai.Client(api_key=GEMINI_API_KEY)
+
+@functools.lru_cache(maxsize=2)
+def _base_generation_config(is_json_response: bool) -> types.GenerateContentConfig:
+    # Validated once; never handed out directly, see _get_model_and_config.
+    return types.GenerateContentConfig(**(_JSON_GENERATION_CONFIG if is_json_response else _TEXT_GENERATION_CONFIG))
+
+def _get_model_and_config(is_json_response: bool, cached_content: Optional[types.CachedContent] = None) -> Tuple[str, types.GenerateContentConfig]:
+    """Returns the model name and request config, bound to the cached document if given."""
+    # SDK config objects are mutable, so every request gets its own (unvalidated, cheap) copy of the template.
+    template = _base_generation_config(is_json_response)
+    if cached_content is None:
+        return MODEL_NAME, template.model_copy()
+    # Cached content can only be used with the model it was created for.
+    return cached_content.model, template.model_copy(update={"cached_content": cached_content.name})
+
+async def create_document_cache(document_text: str, model_name: Optional[str] = None) -> Optional[types.CachedContent]:
+    """
+    Uploads the document once as Gemini cached content so later prompts can reference it
+    instead of resending it. Returns None when the document is too short or caching fails;
+    callers then fall back to sending the document inline.
+    """
+    if not GEMINI_API_KEY or len(document_text) < CONTEXT_CACHE_MIN_CHARS:
+        return None
+    try:
+        return await get_gemini_client().aio.caches.create(
+            model=model_name or MODEL_NAME,
+            config=types.CreateCachedContentConfig(
+                contents=[document_text],
+                ttl=f"{CONTEXT_CACHE_TTL_MINUTES * 60}s",
+            ),
+        )
+    except Exception as e:
+        logger.warning("Gemini context caching unavailable, sending document inline: %s", e)
+        return None
+
+def usable_context_cache(cached_content: Optional[types.CachedContent]) -> Optional[types.CachedContent]:
+    """Returns the cached content unless it is missing or about to expire."""
+    if cached_content is None:
+        return None
+    expire_time = getattr(cached_content, "expire_time", None)
+    if expire_time is not None:
+        cutoff = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+        if expire_time <= cutoff:
+            return None
+    return cached_content
+
+async def _collect_streamed_text(model_name: str, prompt: str, generation_config: types.GenerateContentConfig, stop_at_json_end: bool) -> str:
+    """
+    Streams a response and joins its chunks. With stop_at_json_end, reading stops as soon as the
+    top-level JSON value closes, so any trailing output (JSON mode can pad with whitespace) is not waited for.
+    """
+    response = await get_gemini_client().aio.models.generate_content_stream(
+        model=model_name,
+        contents=[prompt],
+        config=generation_config,
+    )
+    parts = []
+    depth = 0
+    in_string = escaped = False
+    try:
+        async for chunk in response:
+            text = chunk.text
+            if not text:  # chunk without text parts, e.g. the final finish-reason chunk
+                continue
+            if not stop_at_json_end:
+                parts.append(text)
+                continue
+            for i, ch in enumerate(text):
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = True
+                elif ch in "{[":
+                    depth += 1
+                elif ch in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        parts.append(text[:i + 1])
+                        return "".join(parts)
+            parts.append(text)
+        return "".join(parts)
+    finally:
+        # Closing the generator closes the HTTP stream, so an early return stops the generation
+        # instead of leaving it running (and billed) in the background.
+        await response.aclose()
+
+async def generate_text_from_gemini(prompt: str, is_json_response: bool = False, cached_content: Optional[types.CachedContent] = None, stream: bool = False) -> str:
     """
     Generic function to generate text using the Gemini API.
     If is_json_response is True, it configures the API for JSON output.
+    If cached_content is given, the request runs against that cached document.
+    If stream is True, the response is read as it is generated (see _collect_streamed_text).
     """
     try:
-        model = get_gemini_model()
+        model_name, generation_config = _get_model_and_config(is_json_response, cached_content)
 
-        generation_config = genai.types.GenerationConfig(
-            temperature=0.7 # Adjust as needed
-        )
+        if stream:
+            return await _collect_streamed_text(model_name, prompt, generation_config, stop_at_json_end=is_json_response)
 
-        if is_json_response:
-            generation_config.response_mime_type = "application/json"
-
-        response: GenerateContentResponse = await model.generate_content_async(
+        response: types.GenerateContentResponse = await get_gemini_client().aio.models.generate_content(
+            model=model_name,
             contents=[prompt],
-            generation_config=generation_config,
+            config=generation_config,
         )
 
         return response.text
     except Exception as e:
-        print(f"Error during Gemini API call: {e}")
+        logger.exception("Error during Gemini API call: %s", e)
         raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
 
 
-async def generate_summary(document_text: str, max_words: int = 150) -> str:
+def _parse_llm_json(text: str):
+    """
+    Parses a JSON model response. If strict parsing fails and json5 is installed, retries with json5,
+    which accepts trailing commas, comments and unquoted keys. Raises the original JSONDecodeError otherwise.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError as strict_error:
+        if json5 is None:
+            raise
+        try:
+            parsed = json5.loads(text)
+        except ValueError:
+            raise strict_error from None
+        logger.info("Recovered malformed JSON response from Gemini with json5.")
+        return parsed
+
+
+if msgspec is not None:
+    class _ChallengeQuestion(msgspec.Struct):
+        text: str
+        id: Optional[int] = None
+
+    class _ChallengeQuestions(msgspec.Struct):
+        questions: List[_ChallengeQuestion]
+
+    class _Evaluation(msgspec.Struct):
+        is_correct: bool
+        feedback: str
+        justification: str
+
+def _decode_challenge_questions(text: str) -> Optional[List[dict]]:
+    """
+    Decodes and validates well-formed challenge questions in one msgspec pass. Returns None when
+    msgspec is not installed or the response does not match, so callers use the lenient parser instead.
+    """
+    if msgspec is None:
+        return None
+    try:
+        decoded = msgspec.json.decode(text, type=_ChallengeQuestions)
+    except (msgspec.DecodeError, msgspec.ValidationError):
+        return None
+    return [{"id": q.id if q.id is not None else i + 1, "text": q.text} for i, q in enumerate(decoded.questions)]
+
+def _decode_evaluation(text: str) -> Optional[dict]:
+    """Same as _decode_challenge_questions, for answer evaluations."""
+    if msgspec is None:
+        return None
+    try:
+        decoded = msgspec.json.decode(text, type=_Evaluation)
+    except (msgspec.DecodeError, msgspec.ValidationError):
+        return None
+    return msgspec.structs.asdict(decoded)
+
+
+async def embed_text(text: str, task_type: str = "retrieval_query") -> List[float]:
+    """
+    Returns the embedding vector for the given text using the Gemini embedding model.
+    """
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY is not configured. Cannot compute embeddings.")
+    try:
+        result = await get_gemini_client().aio.models.embed_content(
+            model=EMBEDDING_MODEL_NAME,
+            contents=text,
+            config=types.EmbedContentConfig(task_type=task_type.upper()),
+        )
+        return result.embeddings[0].values
+    except Exception as e:
+        logger.exception("Error during Gemini embedding call: %s", e)
+        raise HTTPException(status_code=500, detail=f"Gemini embedding error: {str(e)}")
+
+
+EMBEDDING_BATCH_SIZE = 100  # embed_content accepts at most 100 texts per request
+
+async def embed_texts(texts: List[str], task_type: str = "retrieval_document") -> List[List[float]]:
+    """
+    Returns one embedding vector per text, batching requests to the Gemini embedding model.
+    """
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY is not configured. Cannot compute embeddings.")
+
+    async def _embed_batch(batch: List[str]) -> List[List[float]]:
+        result = await get_gemini_client().aio.models.embed_content(
+            model=EMBEDDING_MODEL_NAME,
+            contents=batch,
+            config=types.EmbedContentConfig(task_type=task_type.upper()),
+        )
+        return [embedding.values for embedding in result.embeddings]
+
+    try:
+        batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+        results = await asyncio.gather(*[_embed_batch(batch) for batch in batches])
+        return [embedding for batch_result in results for embedding in batch_result]
+    except Exception as e:
+        logger.exception("Error during Gemini embedding call: %s", e)
+        raise HTTPException(status_code=500, detail=f"Gemini embedding error: {str(e)}")
+
+
+async def generate_summary(document_text: str, max_words: int = 150, cached_content: Optional[types.CachedContent] = None, no_cache: bool = False) -> str:
     """
     Generates a summary for the given document text using the Gemini API.
+    Results are cached per (model, document, max_words) unless no_cache is set.
     """
-    effective_document_text = document_text
-    if len(document_text) > 20000:
-        print(f"Document text truncated for summary generation from {len(document_text)} to 20000 characters.")
-        effective_document_text = document_text[:20000]
+    cache_key = make_cache_key("summary", MODEL_NAME, max_words, document_text)
+    cached_summary = None if no_cache else await llm_cache.get(cache_key)
+    if cached_summary is not None:
+        return cached_summary
+
+    cached_content = usable_context_cache(cached_content)
+    if cached_content is not None:
+        effective_document_text = CACHED_DOCUMENT_PLACEHOLDER
+    else:
+        effective_document_text = truncate_to_tokens(document_text, SUMMARY_MAX_DOC_TOKENS, "summary generation")
 
 
     prompt = f"""Please provide a concise summary of the following document.
@@ -70,22 +340,30 @@ Document:
 
 Summary:"""
 
-    summary_text = await generate_text_from_gemini(prompt)
+    summary_text = await generate_text_from_gemini(prompt, cached_content=cached_content)
+    if summary_text and not no_cache:
+        await llm_cache.set(cache_key, summary_text)
     return summary_text
 
 
-async def generate_challenge_questions(document_text: str, num_questions: int = 3) -> dict:
+async def generate_challenge_questions(document_text: str, num_questions: int = 3, cached_content: Optional[types.CachedContent] = None, no_cache: bool = False) -> dict:
     """
     Generates a specified number of logic-based or comprehension-focused questions
     from the document using the Gemini API.
 
     Returns a dictionary: {"questions": [{"id": 1, "text": "..."}, {"id": 2, "text": "..."}, ...]}
+    Complete question sets are cached per (model, document, num_questions) unless no_cache is set.
     """
-    MAX_DOC_LENGTH_FOR_CHALLENGE = 50000 
-    effective_document_text = document_text
-    if len(document_text) > MAX_DOC_LENGTH_FOR_CHALLENGE:
-        print(f"Document text truncated for challenge question generation from {len(document_text)} to {MAX_DOC_LENGTH_FOR_CHALLENGE} characters.")
-        effective_document_text = document_text[:MAX_DOC_LENGTH_FOR_CHALLENGE]
+    cache_key = make_cache_key("challenge", MODEL_NAME, num_questions, document_text)
+    cached_questions = None if no_cache else await llm_cache.get(cache_key)
+    if cached_questions is not None:
+        return cached_questions
+
+    cached_content = usable_context_cache(cached_content)
+    if cached_content is not None:
+        effective_document_text = CACHED_DOCUMENT_PLACEHOLDER
+    else:
+        effective_document_text = truncate_to_tokens(document_text, CHALLENGE_MAX_DOC_TOKENS, "challenge question generation")
 
     prompt = f"""You are a tool for creating educational challenges.
 Based *only* on the content of the provided document, generate exactly {num_questions} distinct logic-based or comprehension-focused questions.
@@ -121,53 +399,51 @@ Example of a good response:
 Response (JSON):
 """
 
-    raw_response_text = await generate_text_from_gemini(prompt, is_json_response=True)
+    raw_response_text = await generate_text_from_gemini(prompt, is_json_response=True, cached_content=cached_content, stream=True)
 
     try:
-        parsed_response = json.loads(raw_response_text)
-        if not isinstance(parsed_response, dict) or "questions" not in parsed_response or not isinstance(parsed_response["questions"], list):
-            print(f"Warning: Gemini response for challenge questions was not in the expected JSON format. Raw: {raw_response_text}")
+        valid_questions = _decode_challenge_questions(raw_response_text)
+        if valid_questions is None:
+            parsed_response = _parse_llm_json(raw_response_text)
+            if not isinstance(parsed_response, dict) or "questions" not in parsed_response or not isinstance(parsed_response["questions"], list):
+                logger.warning("Gemini response for challenge questions was not in the expected JSON format. Raw: %s", raw_response_text)
           
-            return {"error": "Failed to parse questions.", "raw_response": raw_response_text}
+                return {"error": "Failed to parse questions.", "raw_response": raw_response_text}
 
 
-        valid_questions = []
-        for i, q_data in enumerate(parsed_response["questions"]):
-            if isinstance(q_data, dict) and "text" in q_data:
-                valid_questions.append({"id": q_data.get("id", i + 1), "text": q_data["text"]})
-            else:
+            valid_questions = []
+            for i, q_data in enumerate(parsed_response["questions"]):
+                if isinstance(q_data, dict) and "text" in q_data:
+                    valid_questions.append({"id": q_data.get("id", i + 1), "text": q_data["text"]})
+                else:
 
-                print(f"Warning: Malformed question object in response: {q_data}")
-                valid_questions.append({"id": i + 1, "text": "Error: Malformed question data."})
+                    logger.warning("Malformed question object in response: %s", q_data)
+                    valid_questions.append({"id": i + 1, "text": "Error: Malformed question data."})
 
         if len(valid_questions) != num_questions and not valid_questions[0].get("text","").startswith("Error"):
-             print(f"Warning: Expected {num_questions} questions, but received {len(valid_questions)}. Raw: {raw_response_text}")
-
+             logger.warning("Expected %s questions, but received %s. Raw: %s", num_questions, len(valid_questions), raw_response_text)
 
-        return {"questions": valid_questions}
+        result = {"questions": valid_questions}
+        if not no_cache and len(valid_questions) == num_questions and not any(q["text"].startswith("Error") for q in valid_questions):
+            await llm_cache.set(cache_key, result)
+        return result
 
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON response from Gemini for challenge questions. Raw: {raw_response_text}")
+    except orjson.JSONDecodeError:
+        logger.exception("Could not decode JSON response from Gemini for challenge questions. Raw: %s", raw_response_text)
         return {"error": "Could not decode JSON response from assistant.", "raw_response": raw_response_text}
     except Exception as e:
-        print(f"Unexpected error parsing challenge questions response: {e}. Raw: {raw_response_text}")
+        logger.exception("Unexpected error parsing challenge questions response: %s. Raw: %s", e, raw_response_text)
         raise HTTPException(status_code=500, detail=f"Error processing assistant's response for challenge questions: {str(e)}")
 
 
-async def evaluate_user_answer(document_text: str, original_question: str, user_answer: str) -> dict:
+@functools.lru_cache(maxsize=64)
+def _evaluation_prompt_prefix(document_text: str) -> str:
     """
-    Evaluates a user's answer to a specific question based on the document text using the Gemini API.
-    Provides feedback and justification.
-
-    Returns a dictionary: {"feedback": "...", "justification": "...", "is_correct": true/false} (example structure)
+    Instructions plus the (truncated) document for evaluation prompts. Every answer in a challenge set
+    is evaluated against the same document string, so the large part of the prompt is built once.
     """
-    MAX_DOC_LENGTH_FOR_EVAL = 50000 
-    effective_document_text = document_text
-    if len(document_text) > MAX_DOC_LENGTH_FOR_EVAL:
-        print(f"Document text truncated for answer evaluation from {len(document_text)} to {MAX_DOC_LENGTH_FOR_EVAL} characters.")
-        effective_document_text = document_text[:MAX_DOC_LENGTH_FOR_EVAL]
-
-    prompt = f"""You are an AI assistant evaluating a user's answer to a question about a document.
+    document_text = truncate_to_tokens(document_text, EVAL_MAX_DOC_TOKENS, "answer evaluation")
+    return f"""You are an AI assistant evaluating a user's answer to a question about a document.
 Your task is to:
 1. Determine if the user's answer is correct based *only* on the provided document.
 2. Provide brief feedback to the user.
@@ -175,10 +451,29 @@ Your task is to:
 
 Document:
 ---
-{effective_document_text}
+{document_text}
 ---
 
-Original Question: {original_question}
+"""
+
+
+async def evaluate_user_answer(document_text: str, original_question: str, user_answer: str, cached_content: Optional[types.CachedContent] = None, no_cache: bool = False) -> dict:
+    """
+    Evaluates a user's answer to a specific question based on the document text using the Gemini API.
+    Provides feedback and justification.
+
+    Returns a dictionary: {"feedback": "...", "justification": "...", "is_correct": true/false} (example structure)
+    Successful evaluations are cached per (model, document, question, answer) unless no_cache is set.
+    """
+    cache_key = make_cache_key("evaluate", MODEL_NAME, original_question, user_answer, document_text)
+    cached_evaluation = None if no_cache else await llm_cache.get(cache_key)
+    if cached_evaluation is not None:
+        return cached_evaluation
+
+    cached_content = usable_context_cache(cached_content)
+    prefix_document = CACHED_DOCUMENT_PLACEHOLDER if cached_content is not None else document_text
+
+    prompt = _evaluation_prompt_prefix(prefix_document) + f"""Original Question: {original_question}
 User's Answer: {user_answer}
 
 Please structure your response as a JSON object with three keys:
@@ -203,37 +498,61 @@ Example of a good response (if user is incorrect):
 Response (JSON):
 """
 
-    raw_response_text = await generate_text_from_gemini(prompt, is_json_response=True)
+    raw_response_text = await generate_text_from_gemini(prompt, is_json_response=True, cached_content=cached_content, stream=True)
 
     try:
-        parsed_response = json.loads(raw_response_text)
-        if not isinstance(parsed_response, dict) or \
-           "is_correct" not in parsed_response or \
-           "feedback" not in parsed_response or \
-           "justification" not in parsed_response:
-            print(f"Warning: Gemini response for answer evaluation was not in the expected JSON format. Raw: {raw_response_text}")
-            return {"error": "Failed to parse evaluation.", "raw_response": raw_response_text, "is_correct": False, "feedback": "Error: Could not parse assistant's evaluation.", "justification": "Raw response: " + raw_response_text}
-
-
-        if not isinstance(parsed_response["is_correct"], bool):
+        parsed_response = _decode_evaluation(raw_response_text)
+        if parsed_response is None:
+            parsed_response = _parse_llm_json(raw_response_text)
+            if not isinstance(parsed_response, dict) or \
+               "is_correct" not in parsed_response or \
+               "feedback" not in parsed_response or \
+               "justification" not in parsed_response:
+                logger.warning("Gemini response for answer evaluation was not in the expected JSON format. Raw: %s", raw_response_text)
+                return {"error": "Failed to parse evaluation.", "raw_response": raw_response_text, "is_correct": False, "feedback": "Error: Could not parse assistant's evaluation.", "justification": "Raw response: " + raw_response_text}
+
+
+            if not isinstance(parsed_response["is_correct"], bool):
            
-            if isinstance(parsed_response["is_correct"], str):
-                if parsed_response["is_correct"].lower() == "true":
-                    parsed_response["is_correct"] = True
-                elif parsed_response["is_correct"].lower() == "false":
-                    parsed_response["is_correct"] = False
-                else:
+                if isinstance(parsed_response["is_correct"], str):
+                    if parsed_response["is_correct"].lower() == "true":
+                        parsed_response["is_correct"] = True
+                    elif parsed_response["is_correct"].lower() == "false":
+                        parsed_response["is_correct"] = False
+                    else:
                    
-                    parsed_response["feedback"] += " (Note: 'is_correct' field from AI was not a clear boolean.)"
-                    parsed_response["is_correct"] = False 
-            else: 
-                 parsed_response["feedback"] += " (Note: 'is_correct' field from AI was not a boolean.)"
-                 parsed_response["is_correct"] = False 
-
+                        parsed_response["feedback"] += " (Note: 'is_correct' field from AI was not a clear boolean.)"
+                        parsed_response["is_correct"] = False 
+                else: 
+                     parsed_response["feedback"] += " (Note: 'is_correct' field from AI was not a boolean.)"
+                     parsed_response["is_correct"] = False 
+
+        if not no_cache:
+            await llm_cache.set(cache_key, parsed_response)
         return parsed_response
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON response from Gemini for answer evaluation. Raw: {raw_response_text}")
+    except orjson.JSONDecodeError:
+        logger.exception("Could not decode JSON response from Gemini for answer evaluation. Raw: %s", raw_response_text)
         return {"error": "Could not decode JSON response from assistant.", "raw_response": raw_response_text, "is_correct": False, "feedback": "Error: Assistant's evaluation was not valid JSON.", "justification": "Raw response: " + raw_response_text}
     except Exception as e:
-        print(f"Unexpected error parsing evaluation response: {e}. Raw: {raw_response_text}")
+        logger.exception("Unexpected error parsing evaluation response: %s. Raw: %s", e, raw_response_text)
         raise HTTPException(status_code=500, detail=f"Error processing assistant's evaluation response: {str(e)}")
+
+
+EVAL_BATCH_MAX_CONCURRENCY = int(os.getenv("GEMINI_EVAL_BATCH_MAX_CONCURRENCY", "5"))
+
+async def evaluate_user_answers_batch(document_text: str, qa_pairs: Sequence[Tuple[str, str]], cached_content: Optional[types.CachedContent] = None, max_concurrency: int = EVAL_BATCH_MAX_CONCURRENCY) -> List[Union[dict, BaseException]]:
+    """
+    Evaluates (question, answer) pairs concurrently, at most max_concurrency Gemini calls at a time.
+    Identical pairs are evaluated once. Returns one result per pair, in order; a failed evaluation
+    is returned as its exception rather than failing the whole batch.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _evaluate_one(question: str, answer: str) -> dict:
+        async with semaphore:
+            return await evaluate_user_answer(document_text, question, answer, cached_content=cached_content)
+
+    unique_pairs = list(dict.fromkeys(qa_pairs))
+    unique_results = await asyncio.gather(*(_evaluate_one(q, a) for q, a in unique_pairs), return_exceptions=True)
+    results_by_pair = dict(zip(unique_pairs, unique_results))
+    return [results_by_pair[pair] for pair in qa_pairs]
@@ -1,71 +1,154 @@
+import functools
 import os
-from typing import TypedDict, Annotated, List
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from typing import TypedDict, Annotated, List, Optional
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver # 
+from app.utils.env_utils import load_env
+from app.utils.gemini_utils import CACHED_DOCUMENT_PLACEHOLDER, generate_summary
+from app.utils.logging_utils import get_logger
+from app.utils.session_store import CHAT_HISTORY_COMPACTED_TURNS, CHAT_HISTORY_MAX_TURNS
 
-# Load environment variables from .env file
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
+load_env()
 
-
-gemini_api_key = os.getenv("GEMINI_API_KEY") 
-if not gemini_api_key:
-    raise ValueError("API key not configured. Set either GEMINI_API_KEY or GOOGLE_API_KEY environment variable.")
+logger = get_logger("graph")
 
 # 1. Define the state for the graph
+class ReplaceChatHistory(list):
+    """A chat_history update that replaces the stored history instead of being appended to it."""
+
+def merge_chat_history(current: List[BaseMessage], update: List[BaseMessage]) -> List[BaseMessage]:
+    if isinstance(update, ReplaceChatHistory):
+        return list(update)
+    return current + update
+
 class AskAnythingState(TypedDict):
     document_text: str
+    # Top-k retrieved chunks for this question; when set they stand in for the document on every turn.
+    document_excerpts: Optional[str]
     input_question: str
-    chat_history: Annotated[List[BaseMessage], lambda x, y: x + y] # Append-only history
+    chat_history: Annotated[List[BaseMessage], merge_chat_history] # Appends, unless compaction replaces it
     answer: str
+    # Set when the document was uploaded as Gemini cached content; the prompt then references it instead of inlining it.
+    context_cache_name: Optional[str]
+    context_cache_model: Optional[str]
 
 
 # 2. Initialize the LLM
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.7)
+# Built on first use and then shared by every request; don't construct clients inside nodes or handlers.
+# Deferring it means importing this module does not require an API key.
+@functools.lru_cache(maxsize=1)
+def get_llm() -> ChatGoogleGenerativeAI:
+    if not (os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")):
+        raise ValueError("API key not configured. Set either GEMINI_API_KEY or GOOGLE_API_KEY environment variable.")
+    return ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.7)
+
+@functools.lru_cache(maxsize=4)
+def _get_cached_content_llm(model_name: str) -> ChatGoogleGenerativeAI:
+    # Cached content can only be used with the model it was created for.
+    return ChatGoogleGenerativeAI(model=model_name, temperature=0.7)
+
+async def compact_chat_history(history: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Once the history grows past CHAT_HISTORY_MAX_TURNS question/answer pairs (plus a summary), keeps
+    the last CHAT_HISTORY_COMPACTED_TURNS of them and folds anything older into one summary message,
+    so the prompt stays bounded however long the conversation runs. Compacting well below the limit
+    means the summary call (and the full history rewrite it causes) only happens every few turns.
+    Returns the history unchanged (same object) when it is within the window.
+    """
+    if len(history) <= 2 * CHAT_HISTORY_MAX_TURNS + 1:
+        return history
+
+    kept_messages = 2 * CHAT_HISTORY_COMPACTED_TURNS
+    dropped, kept = history[:-kept_messages], history[-kept_messages:]
+    transcript_lines = []
+    for message in dropped:
+        if isinstance(message, SystemMessage):
+            speaker = "Earlier summary"
+        elif isinstance(message, AIMessage):
+            speaker = "Assistant"
+        else:
+            speaker = "User"
+        transcript_lines.append(f"{speaker}: {message.content}")
+
+    try:
+        # Transcripts never repeat, so there is nothing to gain from caching their summaries.
+        prefix_summary = await generate_summary("\n".join(transcript_lines), no_cache=True)
+    except Exception as e:
+        logger.warning("Could not summarize dropped chat history, truncating instead: %s", e)
+        return kept
+    return [SystemMessage(content=f"Summary of the earlier conversation: {prefix_summary}"), *kept]
+
+def _as_conversation_turns(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Replaces SystemMessages (the compacted-history summary) with a user/assistant pair. The Gemini
+    client sends SystemMessages as system_instruction, which the API rejects alongside cached_content.
+    """
+    if not any(isinstance(message, SystemMessage) for message in messages):
+        return messages
+    turns = []
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            turns.append(HumanMessage(content=message.content))
+            turns.append(AIMessage(content="Understood, I will take the earlier conversation into account."))
+        else:
+            turns.append(message)
+    return turns
+
+SYSTEM_PROMPT_TEMPLATE = (
+    "You are a helpful AI assistant answering questions based ONLY on the provided document context and the conversation history. "
+    "Do not use any external knowledge. If the answer is not found in the document, say so. "
+    "Be concise and directly answer the question. "
+    "Remember the previous turns of our conversation for context if the user refers to them. "
+    "The document content is provided below."
+    "\n\n--- BEGIN DOCUMENT ---\n{document_text}\n--- END DOCUMENT ---"
+)
+MAX_DOC_LENGTH_FOR_PROMPT = 100000
+
+@functools.lru_cache(maxsize=32)
+def _build_system_prompt(document_text: str) -> str:
+    # A session sends the same document string every turn, so the truncated, formatted prompt is built once.
+    if len(document_text) > MAX_DOC_LENGTH_FOR_PROMPT:
+        document_text = document_text[:MAX_DOC_LENGTH_FOR_PROMPT] + "\n... [document truncated] ..."
+    return SYSTEM_PROMPT_TEMPLATE.format(document_text=document_text)
 
 # 3. Define graph nodes
 async def call_gemini_model_node(state: AskAnythingState):
     messages_for_llm = []
 
-    system_prompt_template = (
-        "You are a helpful AI assistant answering questions based ONLY on the provided document context and the conversation history. "
-        "Do not use any external knowledge. If the answer is not found in the document, say so. "
-        "Be concise and directly answer the question. "
-        "Remember the previous turns of our conversation for context if the user refers to them. "
-        "The document content is provided below."
-        "\n\n--- BEGIN DOCUMENT ---\n{document_text}\n--- END DOCUMENT ---"
-    )
-
-
-    MAX_DOC_LENGTH_FOR_PROMPT = 100000 
-    effective_document_text = state["document_text"]
-    if len(effective_document_text) > MAX_DOC_LENGTH_FOR_PROMPT:
-        effective_document_text = effective_document_text[:MAX_DOC_LENGTH_FOR_PROMPT] + "\n... [document truncated] ..."
-
-    formatted_system_prompt = system_prompt_template.format(document_text=effective_document_text)
-    messages_for_llm.extend(state["chat_history"])
+    context_cache_name = state.get("context_cache_name")
+    document_excerpts = state.get("document_excerpts")
+    chat_history = await compact_chat_history(state["chat_history"])
+    messages_for_llm.extend(chat_history)
 
 
-    if not state["chat_history"]: 
+    if not chat_history: 
+        formatted_system_prompt = _build_system_prompt(CACHED_DOCUMENT_PLACEHOLDER if context_cache_name else (document_excerpts or state["document_text"]))
         full_input_prompt = formatted_system_prompt + f"\n\nUser Question: {state['input_question']}"
         messages_for_llm.append(HumanMessage(content=full_input_prompt))
+    elif document_excerpts:
+        # Retrieval runs per question, so follow-ups get the excerpts relevant to them. Only the bare
+        # question is kept in the history below.
+        messages_for_llm.append(HumanMessage(content=f"Relevant excerpts from the document:\n{document_excerpts}\n\nUser Question: {state['input_question']}"))
     else: 
         messages_for_llm.append(HumanMessage(content=state["input_question"]))
 
 
-    ai_response_message = await llm.ainvoke(messages_for_llm)
+    if context_cache_name:
+        cached_llm = _get_cached_content_llm(state["context_cache_model"])
+        ai_response_message = await cached_llm.ainvoke(_as_conversation_turns(messages_for_llm), cached_content=context_cache_name)
+    else:
+        ai_response_message = await get_llm().ainvoke(messages_for_llm)
 
 
     generated_answer = ai_response_message.content
 
 
 
-    return {"answer": generated_answer, "chat_history": [HumanMessage(content=state["input_question"]), AIMessage(content=generated_answer)]}
+    new_turn = [HumanMessage(content=state["input_question"]), AIMessage(content=generated_answer)]
+    if chat_history is not state["chat_history"]:
+        return {"answer": generated_answer, "chat_history": ReplaceChatHistory([*chat_history, *new_turn])}
+    return {"answer": generated_answer, "chat_history": new_turn}
 
 
 # 4. Define the graph
@@ -77,7 +160,10 @@ workflow.add_edge("llm_call", END)
 
 # Compile the graph
 
-ask_anything_graph_app = workflow.compile(checkpointer=None) # No checkpointer for now
+# No checkpointer: the session store (backed by MongoDB) already owns the bounded chat history and
+# hands the graph a reference to it. A MemorySaver would keep every step's full state, document
+# text included, for every session with no eviction.
+ask_anything_graph_app = workflow.compile(checkpointer=None)
 
 
 async def run_example():
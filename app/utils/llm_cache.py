@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import os
+from typing import Any, Optional
+
+from cachetools import TTLCache
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+from app.utils.logging_utils import get_logger
+
+logger = get_logger("llm_cache")
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./cache")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 86400)))
+
+
+def make_cache_key(namespace: str, *parts: Any) -> str:
+    """Builds an exact-match key from a namespace and the call's inputs (hashed, so documents stay small)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return f"{namespace}:{digest.hexdigest()}"
+
+
+class LLMCache:
+    """
+    Exact-match cache for deterministic-per-input Gemini results (summaries, challenge questions, evaluations).
+    Entries live in an in-process LRU and, when diskcache is installed, on disk so they survive restarts.
+    Both tiers expire entries after LLM_CACHE_TTL_SECONDS.
+    """
+    def __init__(self, directory: Optional[str] = LLM_CACHE_DIR):
+        self._memory: TTLCache = TTLCache(maxsize=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL_SECONDS)
+        self._disk = None
+        if diskcache is not None and directory:
+            try:
+                self._disk = diskcache.Cache(directory)
+            except Exception as e:
+                logger.warning("Failed to open LLM disk cache at %s: %s", directory, e)
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self._memory.get(key)
+        if value is not None or self._disk is None:
+            return value
+        try:
+            value = await asyncio.to_thread(self._disk.get, key)
+        except Exception as e:
+            logger.warning("LLM disk cache read failed: %s", e)
+            return None
+        if value is not None:
+            self._memory[key] = value
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        self._memory[key] = value
+        if self._disk is None:
+            return
+        try:
+            await asyncio.to_thread(self._disk.set, key, value, expire=LLM_CACHE_TTL_SECONDS)
+        except Exception as e:
+            logger.warning("LLM disk cache write failed: %s", e)
+
+
+llm_cache = LLMCache()
@@ -0,0 +1,36 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOGGER_NAME = "ezassignment"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+_listener = None
+
+
+def _configure() -> None:
+    """
+    Routes the "ezassignment" logger through a QueueHandler. Request handlers only enqueue
+    records; a background QueueListener thread formats them and writes to stderr.
+    """
+    global _listener
+    root = logging.getLogger(LOGGER_NAME)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    if _listener is None:
+        _configure()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
@@ -1,142 +1,371 @@
 import os
 import asyncio
-from typing import List, Optional, Dict, Any
-from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
+import time
+import weakref
+import zlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+from bson.binary import Binary
+from bson.codec_options import CodecOptions
+from cachetools import TTLCache
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
-import json
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from app.utils.env_utils import load_env
+from app.utils.logging_utils import get_logger
+
+logger = get_logger("mongo")
+
+load_env()
 
 try:
-    from dotenv import load_dotenv
-    load_dotenv()
+    import zstandard
 except ImportError:
-    pass
+    zstandard = None
+
+# Connection pool settings; the minimum keeps warm connections around so request bursts
+# don't pay for new TCP/TLS handshakes. MONGO_MAX_POOL_SIZE is the budget for the whole server
+# and is split across worker processes (BACKEND_WORKERS, or uvicorn's WEB_CONCURRENCY).
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "200"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_POOL_WORKERS = max(1, int(os.getenv("BACKEND_WORKERS") or os.getenv("WEB_CONCURRENCY") or "1"))
+MONGO_WORKER_MAX_POOL_SIZE = max(1, MONGO_MAX_POOL_SIZE // MONGO_POOL_WORKERS)
+MONGO_WORKER_MIN_POOL_SIZE = min(MONGO_MIN_POOL_SIZE, MONGO_WORKER_MAX_POOL_SIZE)
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+# Wire compression, negotiated with the server in order of preference. zlib is always available;
+# zstd only when zstandard is installed (pymongo warns about compressors it can't load).
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,zlib" if zstandard is not None else "zlib")
+MONGO_ZLIB_COMPRESSION_LEVEL = int(os.getenv("MONGO_ZLIB_COMPRESSION_LEVEL", "6"))
+# Chat histories untouched for this long are deleted by a TTL index; 0 keeps them forever.
+MONGO_CHAT_TTL_SECONDS = int(os.getenv("MONGO_CHAT_TTL_SECONDS", "2592000"))
+# After a failed connect, requests skip MongoDB until the backoff (doubling per failure) has passed.
+MONGO_RECONNECT_BACKOFF_SECONDS = float(os.getenv("MONGO_RECONNECT_BACKOFF_SECONDS", "30"))
+MONGO_RECONNECT_MAX_BACKOFF_SECONDS = float(os.getenv("MONGO_RECONNECT_MAX_BACKOFF_SECONDS", "300"))
+
+# Short-lived read-through cache for documents and chat histories; writes keep it current.
+MONGO_READ_CACHE_SIZE = int(os.getenv("MONGO_READ_CACHE_SIZE", "256"))
+MONGO_READ_CACHE_TTL_SECONDS = int(os.getenv("MONGO_READ_CACHE_TTL_SECONDS", "60"))
+
+# Built once and shared by the database and every collection taken from it.
+MONGO_CODEC_OPTIONS = CodecOptions(tz_aware=True, tzinfo=timezone.utc)
+
+# Stored "type" tag <-> message class; unknown tags load as HumanMessage.
+_MESSAGE_TYPE_TO_CLASS = {"HumanMessage": HumanMessage, "AIMessage": AIMessage, "SystemMessage": SystemMessage}
+_MESSAGE_CLASS_TO_TYPE = {cls: name for name, cls in _MESSAGE_TYPE_TO_CLASS.items()}
+
+# Everything except the (potentially very large) extracted text.
+DOCUMENT_METADATA_PROJECTION = {"text": 0}
+
+def _compress_text(text: str) -> Tuple[str, bytes]:
+    data = text.encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=3).compress(data)
+    return "zlib", zlib.compress(data, 6)
+
+def _decompress_text(codec: str, blob: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Document text is zstd-compressed but zstandard is not installed.")
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+    return zlib.decompress(blob).decode("utf-8")
 
 class MongoDBManager:
     def __init__(self):
-        self.client: Optional[AsyncIOMotorClient] = None
-        self.database: Optional[AsyncIOMotorDatabase] = None
-        self.chat_collection: Optional[AsyncIOMotorCollection] = None
-        self.data_collection: Optional[AsyncIOMotorCollection] = None
+        self.client: Optional[AsyncMongoClient] = None
+        self.database: Optional[AsyncDatabase] = None
+        self.chat_collection: Optional[AsyncCollection] = None
+        self.data_collection: Optional[AsyncCollection] = None
+        self.text_collection: Optional[AsyncCollection] = None
         self.is_connected = False
+        # id(message) -> (weakref to the message, its serialized dict). Messages are pydantic models and
+        # not hashable, so a WeakKeyDictionary can't be used; the weakref callback drops dead entries.
+        self._serialized_messages: Dict[int, Tuple[weakref.ref, Dict[str, Any]]] = {}
+        # Only touched from the event loop between awaits, so no lock is needed.
+        self._document_cache: TTLCache = TTLCache(maxsize=MONGO_READ_CACHE_SIZE, ttl=MONGO_READ_CACHE_TTL_SECONDS)
+        self._chat_cache: TTLCache = TTLCache(maxsize=MONGO_READ_CACHE_SIZE, ttl=MONGO_READ_CACHE_TTL_SECONDS)
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        # Created on first connect, inside the running event loop.
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._connect_failures = 0
+        self._next_connect_attempt = 0.0
         
         self.mongo_uri = os.getenv("MONGODB_URI")
         self.db_name = os.getenv("MONGO_DB_NAME", "EZ")
         self.chat_collection_name = os.getenv("MONGO_CHAT_COLLECTION_NAME", "chat")
         self.data_collection_name = os.getenv("MONGO_DATA_COLLECTION_NAME", "upload_data")
+        # Compressed document text lives apart from the metadata, which is what most reads need.
+        self.text_collection_name = os.getenv("MONGO_TEXT_COLLECTION_NAME", "upload_text")
 
     async def connect(self):
+        """Connects once; safe to call concurrently and again after a failure."""
+        if self.is_connected:
+            return True
         if not self.mongo_uri:
-            print("MongoDB URI not found in environment variables. Running in memory-only mode.")
+            logger.info("MongoDB URI not found in environment variables. Running in memory-only mode.")
             return False
         
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            # Callers that queued behind an attempt see its outcome instead of retrying one by one.
+            if self.is_connected:
+                return True
+            if time.monotonic() < self._next_connect_attempt:
+                return False
+            connected = await self._connect()
+            if connected:
+                self._connect_failures = 0
+                self._next_connect_attempt = 0.0
+            else:
+                self._connect_failures += 1
+                backoff = MONGO_RECONNECT_BACKOFF_SECONDS * 2 ** (self._connect_failures - 1)
+                self._next_connect_attempt = time.monotonic() + min(backoff, MONGO_RECONNECT_MAX_BACKOFF_SECONDS)
+            return connected
+
+    async def _ensure_connected(self) -> bool:
+        """Called by every operation: connects lazily, but not while a failed attempt is backing off."""
+        if self.is_connected:
+            return True
+        if not self.mongo_uri or time.monotonic() < self._next_connect_attempt:
+            return False
+        return await self.connect()
+
+    async def _connect(self) -> bool:
         try:
-            self.client = AsyncIOMotorClient(self.mongo_uri, serverSelectionTimeoutMS=5000)
+            self.client = AsyncMongoClient(
+                self.mongo_uri,
+                serverSelectionTimeoutMS=5000,
+                maxPoolSize=MONGO_WORKER_MAX_POOL_SIZE,
+                minPoolSize=MONGO_WORKER_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                retryWrites=True,
+                compressors=MONGO_COMPRESSORS,
+                zlibCompressionLevel=MONGO_ZLIB_COMPRESSION_LEVEL,
+            )
             await self.client.admin.command('ping')
             
-            self.database = self.client[self.db_name]
+            self.database = self.client.get_database(self.db_name, codec_options=MONGO_CODEC_OPTIONS)
             self.chat_collection = self.database[self.chat_collection_name]
             self.data_collection = self.database[self.data_collection_name]
+            self.text_collection = self.database[self.text_collection_name]
             
             await self._create_indexes()
             self.is_connected = True
-            print(f"Successfully connected to MongoDB database: {self.db_name}")
+            logger.info("Successfully connected to MongoDB database: %s", self.db_name)
             return True
             
         except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-            print(f"Failed to connect to MongoDB: {e}")
-            self.is_connected = False
-            return False
+            logger.error("Failed to connect to MongoDB: %s", e)
         except Exception as e:
-            print(f"Unexpected error connecting to MongoDB: {e}")
-            self.is_connected = False
-            return False
+            logger.exception("Unexpected error connecting to MongoDB: %s", e)
+        self.is_connected = False
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+        return False
 
     async def _create_indexes(self):
-        try:
-            await self.chat_collection.create_index([("session_id", 1), ("document_filename", 1)])
-            await self.chat_collection.create_index([("timestamp", -1)])
-            await self.data_collection.create_index([("filename", 1)])
-            await self.data_collection.create_index([("upload_timestamp", -1)])
-        except Exception as e:
-            print(f"Warning: Failed to create indexes: {e}")
+        # Issued concurrently so startup pays one round trip instead of one per index.
+        chat_timestamp_index = (
+            self.chat_collection.create_index([("timestamp", 1)], expireAfterSeconds=MONGO_CHAT_TTL_SECONDS)
+            if MONGO_CHAT_TTL_SECONDS > 0
+            else self.chat_collection.create_index([("timestamp", -1)])
+        )
+        results = await asyncio.gather(
+            # Unique: exactly one history per (session, document), which chat upserts rely on.
+            self.chat_collection.create_index([("session_id", 1), ("document_filename", 1)], unique=True),
+            chat_timestamp_index,
+            self.data_collection.create_index([("filename", 1)]),
+            self.data_collection.create_index([("upload_timestamp", -1)]),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("Failed to create indexes: %s", result)
 
     async def disconnect(self):
         if self.client:
-            self.client.close()
+            await self.client.close()
             self.is_connected = False
-            print("Disconnected from MongoDB")
+            logger.info("Disconnected from MongoDB")
 
     def _serialize_message(self, message: BaseMessage) -> Dict[str, Any]:
         return {
-            "type": message.__class__.__name__,
+            "type": _MESSAGE_CLASS_TO_TYPE.get(type(message), "HumanMessage"),
             "content": message.content,
-            "additional_kwargs": getattr(message, 'additional_kwargs', {})
+            "additional_kwargs": message.additional_kwargs
         }
 
-    def _deserialize_message(self, data: Dict[str, Any]) -> BaseMessage:
-        message_type = data.get("type", "HumanMessage")
-        content = data.get("content", "")
-        additional_kwargs = data.get("additional_kwargs", {})
-        
-        if message_type == "HumanMessage":
-            return HumanMessage(content=content, additional_kwargs=additional_kwargs)
-        elif message_type == "AIMessage":
-            return AIMessage(content=content, additional_kwargs=additional_kwargs)
-        else:
-            return HumanMessage(content=content, additional_kwargs=additional_kwargs)
+    def _serialize_message_cached(self, message: BaseMessage) -> Dict[str, Any]:
+        """Serializes each message object once; chat history is append-only, so earlier turns are reused."""
+        key = id(message)
+        entry = self._serialized_messages.get(key)
+        if entry is not None and entry[0]() is message:
+            return entry[1]
+        serialized = self._serialize_message(message)
+        self._serialized_messages[key] = (weakref.ref(message, lambda _, key=key: self._serialized_messages.pop(key, None)), serialized)
+        return serialized
+
+    def _deserialize_messages(self, serialized_history: List[Dict[str, Any]]) -> List[BaseMessage]:
+        # Lookups bound to locals: this runs once per stored message on every history read.
+        get_class = _MESSAGE_TYPE_TO_CLASS.get
+        return [
+            get_class(data.get("type"), HumanMessage)(
+                content=data.get("content", ""), additional_kwargs=data.get("additional_kwargs", {})
+            )
+            for data in serialized_history
+        ]
+
+    async def _coalesce(self, key: Tuple, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs fetch() once for concurrent callers asking for the same key; the others await the same task.
+        The task is shielded so one caller being cancelled doesn't cancel the query for the rest.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def _invalidate_document(self, filename: str) -> None:
+        for key in [key for key in self._document_cache.keys() if key[0] == filename]:
+            self._document_cache.pop(key, None)
+
+    def _document_record(self, filename: str, text: str, summary: Optional[str] = None, file_path: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "filename": filename,
+            "summary": summary,
+            "file_path": file_path,
+            "upload_timestamp": datetime.now(timezone.utc),
+            "text_length": len(text)
+        }
+
+    async def _text_record(self, filename: str, text: str) -> Dict[str, Any]:
+        codec, blob = await asyncio.to_thread(_compress_text, text)
+        return {"_id": filename, "codec": codec, "blob": Binary(blob)}
 
     async def store_document(self, filename: str, text: str, summary: Optional[str] = None, file_path: Optional[str] = None) -> bool:
-        if not self.is_connected:
-            print("MongoDB not connected. Document not stored.")
+        if not await self._ensure_connected():
+            logger.debug("MongoDB not connected. Document not stored.")
             return False
         
         try:
-            document_data = {
-                "filename": filename,
-                "text": text,
-                "summary": summary,
-                "file_path": file_path,
-                "upload_timestamp": datetime.utcnow(),
-                "text_length": len(text)
-            }
+            document_data = self._document_record(filename, text, summary, file_path)
+            text_data = await self._text_record(filename, text)
             
-            await self.data_collection.replace_one(
-                {"filename": filename},
-                document_data,
-                upsert=True
+            await asyncio.gather(
+                self.data_collection.replace_one({"filename": filename}, document_data, upsert=True),
+                self.text_collection.replace_one({"_id": filename}, text_data, upsert=True)
             )
-            print(f"Document '{filename}' stored in MongoDB")
+            self._invalidate_document(filename)
+            logger.debug("Document '%s' stored in MongoDB", filename)
             return True
             
         except Exception as e:
-            print(f"Error storing document in MongoDB: {e}")
+            logger.exception("Error storing document in MongoDB: %s", e)
             return False
 
-    async def get_document(self, filename: str) -> Optional[Dict[str, Any]]:
-        if not self.is_connected:
+    async def store_documents_bulk(self, documents: List[Dict[str, Any]]) -> bool:
+        """
+        Upserts several documents in one unordered bulk_write. Each item takes the keyword
+        arguments of store_document (filename and text, optionally summary and file_path).
+        """
+        if not documents or not await self._ensure_connected():
+            return False
+        
+        try:
+            operations = [
+                ReplaceOne({"filename": doc["filename"]}, self._document_record(**doc), upsert=True)
+                for doc in documents
+            ]
+            text_records = await asyncio.gather(*(self._text_record(doc["filename"], doc["text"]) for doc in documents))
+            text_operations = [ReplaceOne({"_id": record["_id"]}, record, upsert=True) for record in text_records]
+            await asyncio.gather(
+                self.data_collection.bulk_write(operations, ordered=False),
+                self.text_collection.bulk_write(text_operations, ordered=False)
+            )
+            for doc in documents:
+                self._invalidate_document(doc["filename"])
+            logger.debug("%s documents stored in MongoDB", len(operations))
+            return True
+            
+        except Exception as e:
+            logger.exception("Error bulk storing documents in MongoDB: %s", e)
+            return False
+
+    async def update_document_summary(self, filename: str, summary: str) -> bool:
+        if not await self._ensure_connected():
+            return False
+        
+        try:
+            await self.data_collection.update_one(
+                {"filename": filename},
+                {"$set": {"summary": summary}}
+            )
+            self._invalidate_document(filename)
+            return True
+        except Exception as e:
+            logger.exception("Error updating document summary in MongoDB: %s", e)
+            return False
+
+    async def get_document(self, filename: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Returns the stored document, or only the given fields of it. The text is only loaded when asked for."""
+        if not await self._ensure_connected():
+            return None
+        
+        cache_key = (filename, tuple(fields) if fields else None)
+        cached = self._document_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        try:
+            document = await self._coalesce(("document", cache_key), lambda: self._fetch_document(filename, fields, cache_key))
+            return dict(document) if document is not None else None
+        except Exception as e:
+            logger.exception("Error retrieving document from MongoDB: %s", e)
+            return None
+
+    async def _fetch_document(self, filename: str, fields: Optional[List[str]], cache_key: Tuple) -> Optional[Dict[str, Any]]:
+        projection = {field: 1 for field in fields} if fields else None
+        document = await self.data_collection.find_one({"filename": filename}, projection)
+        if document is not None and "text" not in document and (not fields or "text" in fields):
+            document["text"] = await self.get_document_text(filename)
+        if document is not None:
+            self._document_cache[cache_key] = document
+        return document
+
+    async def get_document_text(self, filename: str) -> Optional[str]:
+        if not await self._ensure_connected():
             return None
         
         try:
-            document = await self.data_collection.find_one({"filename": filename})
-            return document
+            text_data = await self.text_collection.find_one({"_id": filename})
+            if text_data is None:
+                # Documents stored before the text was split out still carry it inline.
+                legacy = await self.data_collection.find_one({"filename": filename}, {"text": 1})
+                return legacy.get("text") if legacy else None
+            return await asyncio.to_thread(_decompress_text, text_data.get("codec", "zlib"), text_data["blob"])
         except Exception as e:
-            print(f"Error retrieving document from MongoDB: {e}")
+            logger.exception("Error retrieving document text from MongoDB: %s", e)
             return None
 
     async def store_chat_history(self, session_id: str, document_filename: str, chat_history: List[BaseMessage]) -> bool:
-        if not self.is_connected:
+        if not await self._ensure_connected():
             return False
         
         try:
-            serialized_history = [self._serialize_message(msg) for msg in chat_history]
+            serialized_history = [self._serialize_message_cached(msg) for msg in chat_history]
             
             chat_data = {
                 "session_id": session_id,
                 "document_filename": document_filename,
                 "chat_history": serialized_history,
-                "timestamp": datetime.utcnow(),
+                "timestamp": datetime.now(timezone.utc),
                 "message_count": len(chat_history)
             }
             
@@ -145,33 +374,118 @@ class MongoDBManager:
                 chat_data,
                 upsert=True
             )
+            self._chat_cache[(session_id, document_filename)] = list(chat_history)
             return True
             
         except Exception as e:
-            print(f"Error storing chat history in MongoDB: {e}")
+            logger.exception("Error storing chat history in MongoDB: %s", e)
             return False
 
-    async def get_chat_history(self, session_id: str, document_filename: str) -> Optional[List[BaseMessage]]:
-        if not self.is_connected:
+    async def append_chat_messages(self, session_id: str, document_filename: str, new_messages: List[BaseMessage]) -> bool:
+        """Appends messages to the stored history with $push, so earlier turns aren't resent every time."""
+        if not await self._ensure_connected():
+            return False
+        
+        try:
+            await self.chat_collection.update_one(
+                {"session_id": session_id, "document_filename": document_filename},
+                self._append_update(new_messages),
+                upsert=True
+            )
+            cache_key = (session_id, document_filename)
+            cached = self._chat_cache.get(cache_key)
+            if cached is not None:
+                self._chat_cache[cache_key] = cached + list(new_messages)
+            return True
+            
+        except Exception as e:
+            logger.exception("Error appending chat history in MongoDB: %s", e)
+            return False
+
+    async def append_chat_messages_and_get_history(self, session_id: str, document_filename: str, new_messages: List[BaseMessage]) -> Optional[List[BaseMessage]]:
+        """
+        Same as append_chat_messages, but returns the resulting stored history from the same atomic
+        round trip (None on failure). That downloads the whole history, so only use it when the
+        authoritative copy is needed; /ask uses append_chat_messages.
+        """
+        if not await self._ensure_connected():
             return None
         
         try:
-            chat_data = await self.chat_collection.find_one({
-                "session_id": session_id,
-                "document_filename": document_filename
-            })
+            chat_data = await self.chat_collection.find_one_and_update(
+                {"session_id": session_id, "document_filename": document_filename},
+                self._append_update(new_messages),
+                projection={"chat_history": 1, "_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            history = self._deserialize_messages(chat_data["chat_history"])
+            self._chat_cache[(session_id, document_filename)] = history
+            return list(history)
             
-            if not chat_data or "chat_history" not in chat_data:
+        except Exception as e:
+            logger.exception("Error appending chat history in MongoDB: %s", e)
+            return None
+
+    def _append_update(self, new_messages: List[BaseMessage]) -> Dict[str, Any]:
+        return {
+            "$push": {"chat_history": {"$each": [self._serialize_message_cached(msg) for msg in new_messages]}},
+            "$set": {"timestamp": datetime.now(timezone.utc)},
+            "$inc": {"message_count": len(new_messages)}
+        }
+
+    async def get_session_record(self, session_id: str) -> Optional[Tuple[str, List[BaseMessage]]]:
+        """Returns (document filename, chat history) of a session started by /upload, or None if unknown."""
+        if not await self._ensure_connected():
+            return None
+        
+        try:
+            chat_data = await self.chat_collection.find_one(
+                {"session_id": session_id},
+                {"document_filename": 1, "chat_history": 1},
+                sort=[("timestamp", -1)]
+            )
+            if not chat_data:
                 return None
+            history = self._deserialize_messages(chat_data.get("chat_history") or [])
+            self._chat_cache[(session_id, chat_data["document_filename"])] = history
+            return chat_data["document_filename"], list(history)
             
-            return [self._deserialize_message(msg_data) for msg_data in chat_data["chat_history"]]
+        except Exception as e:
+            logger.exception("Error retrieving session from MongoDB: %s", e)
+            return None
+
+    async def get_chat_history(self, session_id: str, document_filename: str) -> Optional[List[BaseMessage]]:
+        if not await self._ensure_connected():
+            return None
+        
+        cache_key = (session_id, document_filename)
+        cached = self._chat_cache.get(cache_key)
+        if cached is not None:
+            return list(cached) or None
+        try:
+            history = await self._coalesce(("chat", cache_key), lambda: self._fetch_chat_history(session_id, document_filename))
+            return list(history) or None
             
         except Exception as e:
-            print(f"Error retrieving chat history from MongoDB: {e}")
+            logger.exception("Error retrieving chat history from MongoDB: %s", e)
             return None
 
+    async def _fetch_chat_history(self, session_id: str, document_filename: str) -> List[BaseMessage]:
+        chat_data = await self.chat_collection.find_one({
+            "session_id": session_id,
+            "document_filename": document_filename
+        })
+        
+        if not chat_data or "chat_history" not in chat_data:
+            history = []  # cache the miss too, so a following append can extend it
+        else:
+            history = self._deserialize_messages(chat_data["chat_history"])
+        self._chat_cache[(session_id, document_filename)] = history
+        return history
+
     async def clear_chat_history(self, session_id: str, document_filename: str) -> bool:
-        if not self.is_connected:
+        if not await self._ensure_connected():
             return False
         
         try:
@@ -179,38 +493,72 @@ class MongoDBManager:
                 "session_id": session_id,
                 "document_filename": document_filename
             })
+            self._chat_cache.pop((session_id, document_filename), None)
             return True
         except Exception as e:
-            print(f"Error clearing chat history from MongoDB: {e}")
+            logger.exception("Error clearing chat history from MongoDB: %s", e)
             return False
 
-    async def get_recent_documents(self, limit: int = 10) -> List[Dict[str, Any]]:
-        if not self.is_connected:
+    async def clear_chat_histories_bulk(self, sessions: List[Tuple[str, str]]) -> bool:
+        """Deletes the chat history of each (session_id, document_filename) pair in one bulk_write."""
+        if not sessions or not await self._ensure_connected():
+            return False
+        
+        try:
+            operations = [
+                DeleteOne({"session_id": session_id, "document_filename": document_filename})
+                for session_id, document_filename in sessions
+            ]
+            await self.chat_collection.bulk_write(operations, ordered=False)
+            for key in sessions:
+                self._chat_cache.pop(tuple(key), None)
+            return True
+        except Exception as e:
+            logger.exception("Error bulk clearing chat histories from MongoDB: %s", e)
+            return False
+
+    async def get_recent_documents(self, limit: int = 10, projection: Optional[Dict[str, Any]] = DOCUMENT_METADATA_PROJECTION) -> List[Dict[str, Any]]:
+        """Returns the most recently uploaded documents; metadata only unless another projection is given."""
+        if not await self._ensure_connected():
             return []
         
         try:
-            cursor = self.data_collection.find({}).sort("upload_timestamp", -1).limit(limit)
+            cursor = self.data_collection.find({}, projection).sort("upload_timestamp", -1).limit(limit)
             documents = await cursor.to_list(length=limit)
             return documents
         except Exception as e:
-            print(f"Error retrieving recent documents: {e}")
+            logger.exception("Error retrieving recent documents: %s", e)
             return []
 
+    async def iter_recent_documents(self, limit: int = 10, projection: Optional[Dict[str, Any]] = DOCUMENT_METADATA_PROJECTION) -> AsyncIterator[Dict[str, Any]]:
+        """Like get_recent_documents, but yields documents as the cursor fetches them instead of building a list."""
+        if not await self._ensure_connected():
+            return
+        
+        try:
+            async for document in self.data_collection.find({}, projection).sort("upload_timestamp", -1).limit(limit):
+                yield document
+        except Exception as e:
+            logger.exception("Error iterating recent documents: %s", e)
+
     async def health_check(self) -> Dict[str, Any]:
-        if not self.is_connected:
+        if not await self._ensure_connected():
             return {"status": "disconnected", "message": "MongoDB not connected"}
         
         try:
-            await self.client.admin.command('ping')
-            doc_count = await self.data_collection.count_documents({})
-            chat_count = await self.chat_collection.count_documents({})
+            # Collection metadata counts instead of full scans, all in one round trip.
+            _, doc_count, chat_count = await asyncio.gather(
+                self.client.admin.command('ping'),
+                self.data_collection.estimated_document_count(),
+                self.chat_collection.estimated_document_count()
+            )
             
             return {
                 "status": "healthy",
                 "database": self.db_name,
                 "documents_stored": doc_count,
                 "chat_sessions": chat_count,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": datetime.now(timezone.utc).isoformat()
             }
         except Exception as e:
             return {"status": "error", "message": str(e)}
@@ -0,0 +1,124 @@
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+    import PyPDF2
+
+# PDFs above this many pages are split across worker processes; smaller ones
+# are parsed inline so they don't pay the process start-up cost.
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "20"))
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+
+class DocumentExtractionError(Exception):
+    """Raised by the extraction helpers; the upload endpoint turns it into an HTTPException."""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def start_pdf_pool() -> None:
+    """Creates the extraction pool; called from the app's startup so it isn't first built inside a request thread."""
+    global _pdf_pool
+    if _pdf_pool is None and PDF_EXTRACTION_WORKERS > 1:
+        # Spawn rather than fork: forking a multi-threaded server can copy a lock another thread holds
+        # (logging, the MongoDB client, PyMuPDF) into the child and deadlock it.
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACTION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    if _pdf_pool is None:
+        start_pdf_pool()
+    return _pdf_pool
+
+
+def shutdown_pdf_pool() -> None:
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+def extract_pages(data: bytes, start: int, end: int) -> str:
+    """Extracts the text of pages [start, end). Top-level so the process pool can pickle it."""
+    page_texts = []
+    if fitz is not None:
+        doc = fitz.open(stream=data, filetype="pdf")
+        try:
+            for page_num in range(start, end):
+                page_texts.append(doc[page_num].get_text("text") or "")
+        finally:
+            doc.close()
+    else:
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        for page_num in range(start, end):
+            page_texts.append(reader.pages[page_num].extract_text() or "")
+    return "".join(page_texts)
+
+
+def _extract_pages_parallel(data: bytes, page_count: int) -> str:
+    pool = _get_pdf_pool()
+    pages_per_chunk = -(-page_count // PDF_EXTRACTION_WORKERS)
+    futures = [
+        pool.submit(extract_pages, data, start, min(start + pages_per_chunk, page_count))
+        for start in range(0, page_count, pages_per_chunk)
+    ]
+    return "".join(future.result() for future in futures)
+
+
+def _extract_fitz(data: bytes) -> str:
+    doc = fitz.open(stream=data, filetype="pdf")
+    try:
+        page_count = doc.page_count
+        if page_count == 0:
+            raise DocumentExtractionError(400, "PDF file has no pages or is corrupted.")
+        if page_count > PDF_PARALLEL_PAGE_THRESHOLD and PDF_EXTRACTION_WORKERS > 1:
+            return _extract_pages_parallel(data, page_count)
+        page_texts = []
+        for page in doc:
+            page_texts.append(page.get_text("text") or "")
+        return "".join(page_texts)
+    finally:
+        doc.close()
+
+
+def _extract_pypdf2(data: bytes) -> str:
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    pages = iter(reader.pages)
+    first_page = next(pages, None)
+    if first_page is None:
+        raise DocumentExtractionError(400, "PDF file has no pages or is corrupted.")
+    page_count = len(reader.pages)
+    if page_count > PDF_PARALLEL_PAGE_THRESHOLD and PDF_EXTRACTION_WORKERS > 1:
+        return _extract_pages_parallel(data, page_count)
+    page_texts = [first_page.extract_text() or ""]
+    for page in pages:
+        page_texts.append(page.extract_text() or "")
+    return "".join(page_texts)
+
+
+def extract_pdf_text(data: bytes) -> str:
+    """
+    Extracts all text from an in-memory PDF, using PyMuPDF when installed and PyPDF2 otherwise.
+    Large documents are fanned out over a process pool. Blocking; call it from a worker thread.
+    """
+    read_errors = (fitz.FileDataError,) if fitz is not None else (PyPDF2.errors.PdfReadError,)
+    try:
+        if fitz is not None:
+            return _extract_fitz(data)
+        return _extract_pypdf2(data)
+    except DocumentExtractionError:
+        raise
+    except read_errors as pre:
+        raise DocumentExtractionError(400, f"Error reading PDF (possibly encrypted or corrupted): {str(pre)}")
+    except Exception as e:
+        raise DocumentExtractionError(500, f"Error processing PDF file: {str(e)}")
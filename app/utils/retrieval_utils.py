@@ -0,0 +1,64 @@
+import heapq
+import math
+import os
+from typing import List, Optional
+
+from app.utils.gemini_utils import embed_texts
+
+RETRIEVAL_CHUNK_SIZE = int(os.getenv("RETRIEVAL_CHUNK_SIZE", "2000"))
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "200"))
+
+
+def normalize_vector(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+def split_text(text: str, chunk_size: int = RETRIEVAL_CHUNK_SIZE, overlap: int = RETRIEVAL_CHUNK_OVERLAP) -> List[str]:
+    """Splits text into overlapping chunks, preferring to break on paragraph or word boundaries."""
+    chunks = []
+    start = 0
+    text_length = len(text)
+    while start < text_length:
+        end = min(start + chunk_size, text_length)
+        if end < text_length:
+            boundary = text.rfind("\n\n", start + chunk_size // 2, end)
+            if boundary == -1:
+                boundary = text.rfind(" ", start + chunk_size // 2, end)
+            if boundary != -1:
+                end = boundary
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= text_length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class DocumentIndex:
+    """In-memory cosine-similarity index over a document's chunks."""
+    def __init__(self, chunks: List[str], embeddings: List[List[float]]):
+        self.chunks = chunks
+        self._embeddings = [normalize_vector(e) for e in embeddings]
+
+    def search(self, query_embedding: List[float], k: int = 4) -> List[str]:
+        """Returns the k most similar chunks, in their original document order."""
+        query = normalize_vector(query_embedding)
+        scores = (
+            (sum(a * b for a, b in zip(query, embedding)), i)
+            for i, embedding in enumerate(self._embeddings)
+        )
+        top_indices = sorted(i for _, i in heapq.nlargest(k, scores))
+        return [self.chunks[i] for i in top_indices]
+
+
+async def build_document_index(document_text: str) -> Optional[DocumentIndex]:
+    """Chunks and embeds the document once so /ask can prompt with only the relevant parts."""
+    chunks = split_text(document_text)
+    if not chunks:
+        return None
+    embeddings = await embed_texts(chunks, task_type="retrieval_document")
+    return DocumentIndex(chunks, embeddings)
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from app.utils.logging_utils import get_logger
+from app.utils.retrieval_utils import normalize_vector
+
+logger = get_logger("semantic_cache")
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_DOCUMENTS = int(os.getenv("SEMANTIC_CACHE_MAX_DOCUMENTS", "64"))
+SEMANTIC_CACHE_MAX_ENTRIES_PER_DOCUMENT = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES_PER_DOCUMENT", "256"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(86400)))
+# Set to an empty string to keep the cache in memory only.
+SEMANTIC_CACHE_DB = os.getenv("SEMANTIC_CACHE_DB", os.path.join(os.getenv("LLM_CACHE_DIR", "./cache"), "semantic_cache.sqlite3"))
+
+
+class SemanticCache:
+    """
+    Question -> answer cache scoped by document hash. A lookup hits when the cosine similarity
+    between the new question's embedding and a cached question's embedding reaches the threshold.
+    Only stateless (first-turn) questions should be cached, since follow-ups depend on history.
+    Entries expire after SEMANTIC_CACHE_TTL_SECONDS and are persisted to SQLite so they survive restarts.
+    """
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, db_path: Optional[str] = SEMANTIC_CACHE_DB):
+        self.threshold = threshold
+        self._entries: LRUCache = LRUCache(maxsize=SEMANTIC_CACHE_MAX_DOCUMENTS)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                # One connection per process, reused for every lookup and store. WAL lets the
+                # other uvicorn workers read the same file while one of them writes.
+                self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS semantic_cache ("
+                    "doc_hash TEXT NOT NULL, question TEXT NOT NULL, answer TEXT NOT NULL, "
+                    "embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS semantic_cache_doc ON semantic_cache (doc_hash, created_at)")
+                self._db.commit()
+            except Exception as e:
+                logger.warning("Failed to open semantic cache database at %s: %s", db_path, e)
+                self._db = None
+
+    def _load(self, doc_hash: str) -> list:
+        if self._db is None:
+            return []
+        cutoff = time.time() - SEMANTIC_CACHE_TTL_SECONDS
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT embedding, question, answer, created_at FROM semantic_cache "
+                "WHERE doc_hash = ? AND created_at >= ? ORDER BY created_at DESC LIMIT ?",
+                (doc_hash, cutoff, SEMANTIC_CACHE_MAX_ENTRIES_PER_DOCUMENT),
+            ).fetchall()
+        # Rows come newest first; entries are kept oldest first so eviction drops from the front.
+        return [(array("f", embedding), question, answer, created_at) for embedding, question, answer, created_at in reversed(rows)]
+
+    def _insert(self, doc_hash: str, embedding: List[float], question: str, answer: str, created_at: float) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO semantic_cache (doc_hash, question, answer, embedding, created_at) VALUES (?, ?, ?, ?, ?)",
+                (doc_hash, question, answer, array("f", embedding).tobytes(), created_at),
+            )
+            self._db.execute("DELETE FROM semantic_cache WHERE created_at < ?", (created_at - SEMANTIC_CACHE_TTL_SECONDS,))
+            self._db.commit()
+
+    async def _get_entries(self, doc_hash: str) -> list:
+        entries = self._entries.get(doc_hash)
+        if entries is None:
+            try:
+                entries = await asyncio.to_thread(self._load, doc_hash)
+            except Exception as e:
+                logger.warning("Semantic cache read failed: %s", e)
+                entries = []
+            self._entries[doc_hash] = entries
+        return entries
+
+    async def lookup(self, doc_hash: str, embedding: List[float]) -> Optional[Tuple[str, str, float]]:
+        """Returns (cached_question, cached_answer, similarity) for the best unexpired match, or None."""
+        entries = await self._get_entries(doc_hash)
+        if not entries:
+            return None
+        query = normalize_vector(embedding)
+        cutoff = time.time() - SEMANTIC_CACHE_TTL_SECONDS
+        best = None
+        best_score = -1.0
+        for cached_embedding, question, answer, created_at in entries:
+            if created_at < cutoff:
+                continue
+            score = sum(a * b for a, b in zip(query, cached_embedding))
+            if score > best_score:
+                best, best_score = (question, answer), score
+        if best is None or best_score < self.threshold:
+            return None
+        return best[0], best[1], best_score
+
+    async def store(self, doc_hash: str, embedding: List[float], question: str, answer: str) -> None:
+        entries = await self._get_entries(doc_hash)
+        normalized = normalize_vector(embedding)
+        created_at = time.time()
+        entries.append((normalized, question, answer, created_at))
+        if len(entries) > SEMANTIC_CACHE_MAX_ENTRIES_PER_DOCUMENT:
+            del entries[0]
+        if self._db is None:
+            return
+        try:
+            await asyncio.to_thread(self._insert, doc_hash, normalized, question, answer, created_at)
+        except Exception as e:
+            logger.warning("Semantic cache write failed: %s", e)
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,61 @@
+import os
+import uuid
+from collections import deque
+from typing import Any, Dict, Iterable, Optional
+
+from cachetools import LRUCache
+
+SESSION_STORE_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", "128"))
+
+# At most CHAT_HISTORY_MAX_TURNS question/answer pairs are re-sent to the model. Past that, the
+# history is compacted to the last CHAT_HISTORY_COMPACTED_TURNS pairs plus a summary message of the
+# rest; compacting to half the window means the summary is only regenerated every few turns.
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "10"))
+CHAT_HISTORY_COMPACTED_TURNS = max(1, CHAT_HISTORY_MAX_TURNS // 2)
+# Hard cap on the in-memory history: a full window plus the summary message and the newest
+# question/answer pair, so nothing is dropped before /ask has had a chance to summarize it.
+CHAT_HISTORY_MAX = 2 * CHAT_HISTORY_MAX_TURNS + 3
+
+
+def new_chat_history(messages: Iterable[Any] = ()) -> deque:
+    return deque(messages, maxlen=CHAT_HISTORY_MAX)
+
+
+class SessionStore:
+    """
+    Keeps per-session document state (filename, text, summary, chat history) in a bounded
+    in-memory LRU. Documents and chat history are also persisted to MongoDB, and the backend's
+    get_session dependency rebuilds a session missing here (evicted, or created by another
+    worker) from there.
+    """
+    def __init__(self, maxsize: int = SESSION_STORE_MAX_SESSIONS):
+        self._sessions: LRUCache = LRUCache(maxsize=maxsize)
+
+    def create(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        session_id = session_id or str(uuid.uuid4())
+        session = {
+            "session_id": session_id,
+            "filename": None,
+            "text": None,
+            "doc_hash": None,
+            "summary": None,
+            "context_cache": None,
+            "retrieval_index": None,
+            "chat_history": new_chat_history()
+        }
+        self._sessions[session_id] = session
+        return session
+
+    def get(self, session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not session_id:
+            return None
+        return self._sessions.get(session_id)
+
+    def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+session_store = SessionStore()
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from google.genai import types
+
+from app.utils import gemini_utils
+
+
+class _FakeModels:
+    def __init__(self):
+        self.configs = []
+
+    async def generate_content(self, model, contents, config):
+        self.configs.append(config)
+        return SimpleNamespace(text="{}")
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    models = _FakeModels()
+    monkeypatch.setattr(gemini_utils, "get_gemini_client", lambda: SimpleNamespace(aio=SimpleNamespace(models=models)))
+    return models
+
+
+def test_config_templates_are_read_only():
+    with pytest.raises(TypeError):
+        gemini_utils._TEXT_GENERATION_CONFIG["response_mime_type"] = "application/json"
+
+
+def test_request_config_changes_do_not_leak():
+    _, config = gemini_utils._get_model_and_config(is_json_response=False)
+    config.response_mime_type = "application/json"
+
+    _, next_config = gemini_utils._get_model_and_config(is_json_response=False)
+    assert next_config is not config
+    assert next_config.response_mime_type is None
+
+
+def test_json_call_leaves_text_config_unchanged(fake_models):
+    asyncio.run(gemini_utils.generate_text_from_gemini("prompt", is_json_response=True))
+    asyncio.run(gemini_utils.generate_text_from_gemini("prompt"))
+
+    json_config, text_config = fake_models.configs
+    assert json_config.response_mime_type == "application/json"
+    assert text_config.response_mime_type is None
+
+
+def test_cached_content_is_bound_per_request():
+    cached = types.CachedContent(name="cachedContents/doc", model="models/gemini-test")
+    model_name, config = gemini_utils._get_model_and_config(is_json_response=False, cached_content=cached)
+    assert model_name == "models/gemini-test"
+    assert config.cached_content == "cachedContents/doc"
+    assert gemini_utils._get_model_and_config(is_json_response=False)[1].cached_content is None
+
+
+def test_streamed_json_stops_and_closes_the_stream(monkeypatch):
+    state = {"chunks_read": 0, "closed": False}
+
+    async def stream():
+        try:
+            for text in ['{"questions": [{"te', 'xt": "a}"}]}', "  ", "never read"]:
+                state["chunks_read"] += 1
+                yield SimpleNamespace(text=text)
+        finally:
+            state["closed"] = True
+
+    async def generate_content_stream(model, contents, config):
+        return stream()
+
+    models = SimpleNamespace(generate_content_stream=generate_content_stream)
+    monkeypatch.setattr(gemini_utils, "get_gemini_client", lambda: SimpleNamespace(aio=SimpleNamespace(models=models)))
+
+    async def generate():
+        text = await gemini_utils.generate_text_from_gemini("prompt", is_json_response=True, stream=True)
+        # Checked before asyncio.run finalizes leftover generators at shutdown.
+        return text, state["closed"]
+
+    text, closed_on_return = asyncio.run(generate())
+
+    assert text == '{"questions": [{"text": "a}"}]}'
+    assert state["chunks_read"] == 2
+    assert closed_on_return